@@ -1,6 +1,6 @@
 
 from pyxdaq.xdaq import get_XDAQ, XDAQ
-from pyxdaq.stim import enable_stim
+from pyxdaq.stim import StimProgram
 from pyxdaq.constants import StimStepSize, StimShape, StartPolarity, TriggerEvent, TriggerPolarity
 from pyxdaq.impedance import Frequency, Strategy
 import math
@@ -111,6 +111,10 @@ def create_biphasic_pulse(mA: float, frequency: float):
         pulses=1,
     )
 
+# Stim programs by (stream, channel, current, frequency), compiled once and re-armed cheaply
+stim_programs = {}
+
+
 def send_pulses(
     xdaq: XDAQ,
     stream: int,
@@ -122,36 +126,45 @@ def send_pulses(
     # The software trigger id, 0~7, can be shared by multiple stim
     software_trigger_id = 0
 
-    # The enable_stim function will return a function to disable the stim
-    disable_stim = enable_stim(
-        xdaq=xdaq,
-        stream=stream,
-        channel=channel,
-        # Trigger source, 24~31 is the software trigger 0~7
-        trigger_source=24 + software_trigger_id,
-        **create_biphasic_pulse(pulse_current_mA, pulse_frequency)
-        # **create_monophasic_pulse(pulse_current_mA, pulse_frequency)
-    )
-
-    # Enable software trigger
-    xdaq.manual_trigger(software_trigger_id, True)
+    # A StimProgram is compiled once per set of pulse parameters, arming it again only toggles the
+    # trigger of the channel as long as it is still loaded on the chip
+    key = (stream, channel, pulse_current_mA, pulse_frequency)
+    if key not in stim_programs:
+        stim_programs[key] = StimProgram(
+            xdaq,
+            [
+                dict(
+                    stream=stream,
+                    channel=channel,
+                    # Trigger source, 24~31 is the software trigger 0~7
+                    trigger_source=24 + software_trigger_id,
+                    **create_biphasic_pulse(pulse_current_mA, pulse_frequency)
+                    # **create_monophasic_pulse(pulse_current_mA, pulse_frequency)
+                )
+            ],
+        )
 
     # Calculate the number of steps to run, the number of steps should be multiple of 128 to avoid alignment error
     run_steps = (int(duration_ms / 1000 * xdaq.sampleRate.rate) + 127) // 128 * 128
 
-    # Start running
-    xdaq.setStimCmdMode(True)
-    # Speed up the process by discarding the reading of the data block
-    # It's possible to run without blocking the script, but this will require more complex logic
-    # See runAndReadDataBlock function for more fine-grained control
-    xdaq.runAndReadDataBlock(run_steps, discard=True)
-    xdaq.setStimCmdMode(False)
-    # Stop running
-
-    # Disable software trigger after the run
-    xdaq.manual_trigger(software_trigger_id, False)
-    # Disable the stim, a stim can run multiple times, here we set the stim every time for demonstration
-    disable_stim()
+    # The stim is armed inside the with block and disarmed after the run
+    with stim_programs[key]:
+        # Enable software trigger
+        xdaq.manual_trigger(software_trigger_id, True)
+
+        # Start running
+        xdaq.setStimCmdMode(True)
+        # Run in the background, the data is drained and dropped while the progress is reported,
+        # Ctrl+C cancels the run and stops the sequencer cleanly
+        # Pass callback=... and decimate=... to runInBackground to monitor the data
+        with xdaq.runInBackground(run_steps) as run:
+            while not run.wait(10):
+                print(f'  {run.progress:.0%}', end='\r')
+        xdaq.setStimCmdMode(False)
+        # Stop running
+
+        # Disable software trigger after the run
+        xdaq.manual_trigger(software_trigger_id, False)
 
     return run_steps
 
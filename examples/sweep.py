@@ -75,20 +75,24 @@ for target_channel in channels:
         magnitudes = []
         phases = []
 
-        # Perform frequency sweep
-        for freq in range(50, 1150, 100):
-            print(f'Channel {target_channel}: Checking impedance at {freq} Hz, Sweep {sweep_number}')
-
-            magnitude, phase = xdaq.measure_impedance(
-                frequency=Frequency(freq),
-                strategy=Strategy.from_duration(0.2),
-                channels=[actual_channel],
-                progress=False
-            )
-
+        # Perform frequency sweep, all frequencies are measured in one call
+        print(
+            f'Channel {target_channel}: Checking impedance from 50 to 1050 Hz, '
+            f'Sweep {sweep_number}'
+        )
+        sweep_frequencies = list(range(50, 1150, 100))
+        magnitude, phase = xdaq.measure_impedance_sweep(
+            sweep_frequencies,
+            strategy=Strategy.from_duration(0.2),
+            channels=[actual_channel],
+            progress=False
+        )
+
+        # magnitude and phase have the shape (frequency, stream, channel)
+        for i, freq in enumerate(sweep_frequencies):
             frequencies.append(freq)
-            magnitudes.append(magnitude[0])
-            phases.append(phase[0])
+            magnitudes.append(magnitude[i, 0])
+            phases.append(phase[i, 0])
 
         # Data preparation for saving
         data = {
@@ -0,0 +1,133 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from .datablock import DataBlock
+from .stream import DataStream
+from .xdaq import XDAQ
+from . import impedance
+
+
+class AsyncDataStream:
+    """
+    Async iterator over a DataStream, see AsyncXDAQ.stream.
+    """
+
+    def __init__(self, axdaq: 'AsyncXDAQ', stream: DataStream):
+        self.axdaq = axdaq
+        self.stream = stream
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> DataBlock:
+        # waiting for the next buffer does not touch the device, keep it off the device executor
+        loop = asyncio.get_running_loop()
+        block = await loop.run_in_executor(None, next, self.stream, None)
+        if block is None:
+            raise StopAsyncIteration
+        return block
+
+    async def __aenter__(self) -> 'AsyncDataStream':
+        await self.axdaq._run(self.stream.start)
+        self.axdaq._stream = self.stream
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.axdaq._stream = None
+        await self.axdaq._run(self.stream.stop)
+
+
+class AsyncXDAQ:
+    """
+    asyncio facade for XDAQ. Blocking FrontPanel calls run on a single worker thread so device
+    access stays serialized while the event loop is free for UI updates, file writing, etc.
+
+    Any XDAQ method is available as a coroutine, e.g. `await axdaq.setStimCmdMode(True)`.
+
+    Example:
+        async with AsyncXDAQ(get_XDAQ(rhs=True)) as axdaq:
+            block = await axdaq.run_and_read(128 * 100)
+            async with axdaq.stream() as stream:
+                async for block in stream:
+                    ...
+    """
+
+    def __init__(self, xdaq: XDAQ, executor: ThreadPoolExecutor = None):
+        self.xdaq = xdaq
+        self._own_executor = executor is None
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='pyxdaq'
+        ) if executor is None else executor
+        self._stream = None
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def call(self, fn, *args, **kwargs):
+        """
+        Run a blocking function on the device thread. While a stream is active the call holds the
+        stream lock, so it does not interleave with the background reader.
+        """
+        stream = self._stream
+        if stream is None:
+            return await self._run(fn, *args, **kwargs)
+
+        def locked():
+            with stream.lock:
+                return fn(*args, **kwargs)
+
+        return await self._run(locked)
+
+    def __getattr__(self, name):
+        attr = getattr(self.xdaq, name)
+        if not callable(attr):
+            return attr
+        return functools.partial(self.call, attr)
+
+    async def run_and_read(self, samples: int, discard: bool = False) -> Union[DataBlock, None]:
+        return await self.call(self.xdaq.runAndReadDataBlock, samples, discard)
+
+    async def measure_impedance(
+        self,
+        frequency: impedance.Frequency,
+        strategy: impedance.Strategy = impedance.Strategy.auto(),
+        channels: List[int] = None,
+        progress: bool = False,
+        raw_data_return: bool = False,
+    ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+        return await self.call(
+            self.xdaq.measure_impedance, frequency, strategy, channels, progress, raw_data_return
+        )
+
+    def stream(
+        self,
+        chunk_samples: int = 128 * 64,
+        buffers: int = 16,
+        timeout: Union[float, None] = None
+    ) -> AsyncDataStream:
+        """
+        Continuous acquisition as an async iterator, use with `async with`.
+        See XDAQ.stream for the parameters.
+        """
+        return AsyncDataStream(self, self.xdaq.stream(chunk_samples, buffers, timeout))
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+    async def aclose(self):
+        """
+        Same as `close`, waiting for the device call in flight without blocking the event loop.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self) -> 'AsyncXDAQ':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
@@ -1,9 +1,11 @@
+import time
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Callable, Tuple, Union
 
 from . import ok
 from .constants import EndPoints
-from .utils import DebugWrapper
+from .utils import DebugWrapper, ProfilingWrapper
 
 
 class Board:
@@ -39,42 +41,116 @@ class Board:
     def config_fpga(self, bitfile: str = None) -> Tuple[int, int]:
         raise NotImplementedError
 
+    # boards without host side wire buffering send every call right away, the batching and
+    # caching hooks used by XDAQ default to no-ops
+
+    def batch(self):
+        return nullcontext()
+
+    def invalidate(self):
+        pass
+
+    def reset_host_state(self):
+        pass
+
+    def wireOutSnapshot(self, max_age: float = 0):
+        return nullcontext()
+
 
 class OkBoard(Board):
     """
     Abstract class for interacting with the okFrontPanel API.
     """
 
-    def __init__(self, debug: Union[bool, Callable] = False, dev: ok.okCFrontPanel = None):
+    def __init__(
+        self,
+        debug: Union[bool, Callable] = False,
+        dev: 'ok.okCFrontPanel' = None,
+        profile: bool = False
+    ):
         if dev is None:
             dev = self._get_device()
         self.dev = DebugWrapper(dev, debug) if debug else dev
+        # per-call statistics of the device calls, see ProfilingWrapper
+        self.profiler = None
+        if profile:
+            self.dev = self.profiler = ProfilingWrapper(self.dev)
+        self._batch_depth = 0
+        # endpoint -> (value, mask) written to the host buffer but not sent yet, see batch
+        self._pending = {}
+        # endpoint -> (value, mask of the known bits) last written to the device
+        self._shadow = {}
+        # time of the last UpdateWireOuts, None once the device was commanded since
+        self._wire_outs_at = None
+        self._snapshot_depth = 0
 
     def is_open(self) -> bool:
         return self.dev.IsOpen()
 
     def GetWireOutValue(self, addr: EndPoints, update: bool = True) -> int:
         if update:
-            self.dev.UpdateWireOuts()
+            self.updateWireOuts(None if self._snapshot_depth else 0)
         return self.dev.GetWireOutValue(addr.value)
 
+    def updateWireOuts(self, max_age: Union[float, None] = 0):
+        """
+        Refresh the wire-outs unless the current values are younger than `max_age` seconds, with
+        max_age=None they are refreshed only when the device was commanded since the last update.
+        """
+        if self._wire_outs_at is not None and (max_age is None or
+                                               time.perf_counter() - self._wire_outs_at < max_age):
+            return
+        self.flushWireIns()
+        self.dev.UpdateWireOuts()
+        self._wire_outs_at = time.perf_counter()
+
     def SetWireInValue(
         self, addr: EndPoints, value: int, mask: int = 0xffffffff, update: bool = True
     ):
-        self.dev.SetWireInValue(addr.value, value, mask)
-        if update:
+        """
+        Writes that do not change the known value of the masked bits are skipped, writes with
+        update=False are sent with the next update, trigger or block pipe transfer.
+        """
+        shadow, known = self._shadow.get(addr.value, (0, 0))
+        if mask & ~known or (value ^ shadow) & mask:
+            pending = self._pending.get(addr.value)
+            if pending is not None and (pending[0] ^ value) & pending[1] & mask:
+                # the device has to see the pending bits before they are overwritten, e.g. pulses
+                self.flushWireIns()
+                pending = None
+            self.dev.SetWireInValue(addr.value, value, mask)
+            self._shadow[addr.value] = ((shadow & ~mask) | (value & mask), known | mask)
+            if pending is not None:
+                value, mask = (pending[0] & ~mask) | (value & mask), pending[1] | mask
+            self._pending[addr.value] = (value & mask, mask)
+        if update and self._batch_depth == 0:
+            self.flushWireIns()
+
+    def flushWireIns(self):
+        """
+        Send the pending wire-in writes.
+        """
+        if self._pending:
+            self._pending.clear()
+            self._wire_outs_at = None
             self.dev.UpdateWireIns()
 
     def ActivateTriggerIn(self, addr: EndPoints, value: int):
+        self.flushWireIns()
+        self._wire_outs_at = None
         self.dev.ActivateTriggerIn(addr.value, value)
 
     def WriteToBlockPipeIn(self, epAddr: EndPoints, blockSize: int, data: bytearray):
+        self.flushWireIns()
+        self._wire_outs_at = None
         ret = self.dev.WriteToBlockPipeIn(epAddr.value, blockSize, data)
         if ret < 0:
             raise RuntimeError(f'WriteToBlockPipeIn failed with error code {ret}')
         return ret
 
     def ReadFromBlockPipeOut(self, epAddr: EndPoints, blockSize: int, data: bytearray):
+        self.flushWireIns()
+        self._wire_outs_at = None
         ret = self.dev.ReadFromBlockPipeOut(epAddr.value, blockSize, data)
         if ret < 0:
             raise RuntimeError(f'ReadFromBlockPipeOut failed with error code {ret}')
@@ -83,12 +159,84 @@ class OkBoard(Board):
     def SendTrig(
         self, trig: EndPoints, bit: int, epAddr: EndPoints, value: int, mask: int = 0xffffffff
     ):
-        self.dev.SetWireInValue(epAddr.value, value, mask)
-        self.dev.UpdateWireIns()
-        self.dev.ActivateTriggerIn(trig.value, bit)
+        self.SetWireInValue(epAddr, value, mask)
+        self.ActivateTriggerIn(trig, bit)
+
+    def batch(self):
+        """
+        Defer UpdateWireIns until the end of the context so that consecutive wire-in writes are
+        sent in one USB transaction. Pending writes are sent before any trigger, block pipe
+        transfer or wire-out update, and before a write that changes pending bits of the same
+        endpoint, so the device observes the same sequence of values as without batching.
+        Contexts can be nested, the outermost one flushes.
+
+        Example:
+            with board.batch():
+                board.SetWireInValue(RHD.WireInDacSource1, 0)
+                board.SetWireInValue(RHD.WireInDacSource2, 0)
+        """
+
+        class Context:
+
+            def __init__(self, board: OkBoard):
+                self.board = board
+
+            def __enter__(self):
+                self.board._batch_depth += 1
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                self.board._batch_depth -= 1
+                if self.board._batch_depth == 0:
+                    self.board.flushWireIns()
+
+        return Context(self)
+
+    def invalidate(self):
+        """
+        Forget the wire-in values known to be on the device, the next write of every endpoint is
+        sent. Required when the wire-ins may have changed behind the board, e.g. after the FPGA is
+        reconfigured or the device is written to directly.
+        """
+        self._shadow.clear()
+
+    def reset_host_state(self):
+        """
+        Drop the pending wire-in writes, the known wire-in values and the wire-out snapshot, the
+        device state they describe is gone once the FPGA is (re)configured.
+        """
+        self._pending.clear()
+        self.invalidate()
+        self._wire_outs_at = None
+
+    def wireOutSnapshot(self, max_age: float = 0):
+        """
+        Serve the wire-out reads inside the context from a single UpdateWireOuts. The snapshot is
+        taken when the context is entered, unless the current one is younger than `max_age`
+        seconds, and is reused until a trigger, block pipe transfer or wire-in update may have
+        changed the device state. Nested contexts share the snapshot of the outermost one.
+
+        Example:
+            with board.wireOutSnapshot():
+                words = board.GetWireOutValue(RHD.WireOutNumWords)
+                running = board.GetWireOutValue(RHD.WireOutSpiRunning)
+        """
+
+        class Context:
+
+            def __init__(self, board: OkBoard):
+                self.board = board
+
+            def __enter__(self):
+                self.board.updateWireOuts(None if self.board._snapshot_depth else max_age)
+                self.board._snapshot_depth += 1
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                self.board._snapshot_depth -= 1
+
+        return Context(self)
 
     @classmethod
-    def _get_device(cls) -> ok.okCFrontPanel:
+    def _get_device(cls) -> 'ok.okCFrontPanel':
         dev = ok.okCFrontPanel()
         supported = [ok.okPRODUCT_XEM7310A75, ok.okPRODUCT_XEM6310LX45]
         for i in range(dev.GetDeviceCount()):
@@ -104,6 +252,7 @@ class OkBoard(Board):
     def config_fpga(self, bitfile: Union[str, Path]) -> Tuple[int, int]:
         if not Path(bitfile).exists():
             raise FileNotFoundError(f'bitfile {bitfile} not found')
+        self.reset_host_state()
         error_code = self.dev.ConfigureFPGA(str(bitfile))
         if error_code != ok.okCFrontPanel.NoError:
             raise RuntimeError(f'Configure FPGA failed {error_code}')
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class BufferPool:
+    """
+    Reusable read buffers grouped by size class.
+
+    A block pipe read transfers exactly `len(buffer)` bytes, so a size class is the exact request
+    rounded up to the 1024 bytes pipe block size. Acquisition loops read the same sizes over and
+    over, so after the first iteration every read is served from the pool. At most
+    `per_class` free buffers are kept per size and at most `classes` sizes are kept, the least
+    recently used size is dropped first.
+    """
+
+    def __init__(self, per_class: int = 4, classes: int = 16):
+        self.per_class = per_class
+        self.classes = classes
+        self._free = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def size_class(size: int) -> int:
+        return max(((size + 1023) // 1024) * 1024, 1024)
+
+    @staticmethod
+    def chunk_size(available: int) -> int:
+        """
+        Largest power-of-two multiple of the pipe block size not above `available` (at least one
+        block), reads sized this way come from a handful of size classes.
+        """
+        return 1024 << (max(available // 1024, 1).bit_length() - 1)
+
+    def acquire(self, size: int) -> bytearray:
+        """
+        Get a buffer of `size_class(size)` bytes, the content is undefined.
+        """
+        size = self.size_class(size)
+        with self._lock:
+            free = self._free.get(size)
+            if free:
+                self._free.move_to_end(size)
+                self.hits += 1
+                return free.pop()
+            self.misses += 1
+        return bytearray(size)
+
+    def release(self, buffer: bytearray):
+        size = len(buffer)
+        if size != self.size_class(size):
+            raise ValueError(f'Buffer of {size} bytes does not belong to a size class')
+        with self._lock:
+            free = self._free.setdefault(size, [])
+            self._free.move_to_end(size)
+            if len(free) < self.per_class:
+                free.append(buffer)
+            while len(self._free) > self.classes:
+                self._free.popitem(last=False)
+
+    @contextmanager
+    def borrow(self, size: int):
+        """
+        Acquire a buffer for the duration of a with block.
+        """
+        buffer = self.acquire(size)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
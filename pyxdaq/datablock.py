@@ -1,3 +1,4 @@
+import functools
 import struct
 from dataclasses import dataclass
 from typing import List, Union
@@ -87,6 +88,17 @@ class Samples(Sample):
     """
     n: int
 
+    def copy(self) -> 'Samples':
+        """
+        Materialize every field into a contiguous array that no longer references the raw buffer.
+        """
+        return Samples(
+            self.ts.astype(np.int64), np.array(self.aux), np.array(self.amp), np.array(self.adc),
+            np.array(self.ttlin), np.array(self.ttlout),
+            None if self.dac is None else np.array(self.dac),
+            None if self.stim is None else np.array(self.stim), self.n
+        )
+
     def device_name(self):
         if self.n != 128:
             raise ValueError("Unable to determine device name for non-128 sample data block")
@@ -112,39 +124,294 @@ class Samples(Sample):
             return aux[:, 0].T, np.zeros_like(aux[:, 0].T)
 
 
+@functools.lru_cache(maxsize=None)
+def sample_dtype(rhs: bool, datastreams: int, mode32DIO: bool) -> np.dtype:
+    """
+    Structured dtype describing one sample of the XDAQ data stream, the itemsize matches
+    `getBlocksizeInWords(rhs, mode32DIO, 1, datastreams, 32) * 2`.
+    """
+    fields = [('magic', '<u8'), ('ts', _uint32le)]
+    if rhs:
+        fields += [
+            ('aux', _uint16le, (3, datastreams, 2)),
+            ('amp', _uint16le, (16, datastreams, 2)),
+            ('aux0', _uint16le, (1, datastreams, 2)),
+            ('stim', _uint16le, (4, datastreams)),
+            ('dac', _uint16le, (8,)),
+            ('adc', _uint16le, (8,)),
+            ('ttlin', _uint16le, (1,)),
+            ('ttlout', _uint16le, (1,)),
+        ]
+    else:
+        padding = (datastreams + 2 * mode32DIO) % 4
+        fields += [
+            ('aux', _uint16le, (3, datastreams)),
+            ('amp', _uint16le, (32, datastreams)),
+        ]
+        if padding:
+            fields.append(('padding', _uint16le, (padding,)))
+        ttl = _uint32le if mode32DIO else _uint16le
+        fields += [
+            ('adc', _uint16le, (8,)),
+            ('ttlin', ttl, (1,)),
+            ('ttlout', ttl, (1,)),
+        ]
+    return np.dtype(fields)
+
+
+def _header_magic(rhs: bool) -> int:
+    return _RHS_HEADER_MAGIC if rhs else _RHD_HEADER_MAGIC
+
+
+@dataclass
+class BlockCheck:
+    """
+    Result of `check_block`, all indices refer to samples inside the checked block.
+    """
+    n: int
+    misaligned: np.ndarray
+    # indices of samples with an invalid header magic (frame misalignment or corruption)
+    gaps: np.ndarray
+    # indices of samples preceded by missing timestamps
+    missing: np.ndarray
+    # number of samples missing right before each entry of `gaps`
+    duplicates: np.ndarray
+    # indices of samples whose timestamp did not advance (repeated or going backwards)
+    last_ts: Union[int, None]
+    # timestamp of the last valid sample, pass it to the next `check_block` call
+
+    @property
+    def ok(self) -> bool:
+        return len(self.misaligned) == 0 and len(self.gaps) == 0 and len(self.duplicates) == 0
+
+    @property
+    def dropped(self) -> int:
+        return int(self.missing.sum())
+
+
+def check_block(data: np.ndarray, rhs: bool, last_ts: Union[int, None] = None) -> BlockCheck:
+    """
+    Validate every header magic and timestamp step of a block of `sample_dtype` records in one
+    vectorized pass. Timestamps are compared modulo 2**32 so wrap-around is not a gap.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Structured array of samples, e.g. `DataBlock.data`.
+    rhs : bool
+        Which header magic to expect.
+    last_ts : int
+        Timestamp of the sample preceding this block, to check continuity across reads.
+    """
+    valid = data['magic'] == _header_magic(rhs)
+    misaligned = np.flatnonzero(~valid)
+    # compare every valid sample with the previous valid one, a misaligned sample in between
+    # accounts for one timestamp step
+    idx = np.flatnonzero(valid)
+    ts = data['ts'][idx]
+    if last_ts is not None:
+        prev = np.concatenate((np.array([last_ts], dtype=ts.dtype), ts[:-1]))
+        step = np.diff(idx, prepend=-1)
+        pos = idx
+    else:
+        prev = ts[:-1]
+        ts = ts[1:]
+        step = np.diff(idx)
+        pos = idx[1:]
+    # uint32 subtraction wraps around with the timestamp counter
+    delta = (ts - prev).astype(np.int64)
+    delta[delta >= 2**31] -= 2**32
+    duplicates = pos[delta <= 0]
+    gap = delta > step
+    return BlockCheck(
+        n=len(data),
+        misaligned=misaligned,
+        gaps=pos[gap],
+        missing=delta[gap] - step[gap],
+        duplicates=duplicates,
+        last_ts=int(data['ts'][idx[-1]]) if len(idx) > 0 else last_ts,
+    )
+
+
 @dataclass
 class DataBlock:
     """
     Raw data block which keeps the original memory layout.
     """
-    samples: List[Sample]
-    # Samples x C x Datastreams : [C x Datastreams] [C x Datastreams] ... [C x Datastreams]
+    data: np.ndarray
+    # Structured array of `sample_dtype`, one record per sample, viewing the raw buffer
+    rhs: bool
 
     @classmethod
     def from_buffer(
-        cls, rhs, sample_size, buffer: Union[bytearray, memoryview], datastreams: int,
-        mode32DIO: bool
+        cls,
+        rhs,
+        sample_size,
+        buffer: Union[bytearray, memoryview],
+        datastreams: int,
+        mode32DIO: bool,
+        resync: bool = False,
     ) -> 'DataBlock':
-        return cls(
-            [
-                Sample.from_buffer(rhs, buffer[i:i + sample_size], datastreams, mode32DIO)
-                for i in range(0, len(buffer), sample_size)
-            ]
-        )
+        """
+        Decode a buffer of whole samples. With `resync` misaligned or corrupted frames are skipped
+        by searching for the next header magic instead of raising, see `BlockDecoder`.
+        """
+        dtype = sample_dtype(rhs, datastreams, mode32DIO)
+        if dtype.itemsize != sample_size:
+            raise ValueError(f"Sample size mismatch: {sample_size} != {dtype.itemsize}")
+        if resync:
+            return BlockDecoder(rhs, datastreams, mode32DIO).decode(buffer)
+        data = np.frombuffer(buffer, dtype=dtype, count=len(buffer) // sample_size)
+        bad = np.flatnonzero(data['magic'] != _header_magic(rhs))
+        if len(bad) > 0:
+            raise ValueError(f"Invalid magic: {data['magic'][bad[0]]} at sample {bad[0]}")
+        return cls(data, rhs)
 
-    def to_samples(self) -> Samples:
+    def __len__(self):
+        return len(self.data)
+
+    def check(self, last_ts: Union[int, None] = None) -> BlockCheck:
+        """
+        Check the block for dropped or repeated samples, see `check_block`.
+        """
+        return check_block(self.data, self.rhs, last_ts)
+
+    @property
+    def samples(self) -> List[Sample]:
+        """
+        Per-sample view of the block, kept for compatibility; prefer `to_samples`.
+        """
+        return [
+            Sample(
+                int(r['ts']),
+                np.concatenate((r['aux0'], r['aux']), axis=0) if self.rhs else r['aux'],
+                r['amp'],
+                r['adc'],
+                r['ttlin'],
+                r['ttlout'],
+                r['dac'] if self.rhs else None,
+                r['stim'] if self.rhs else None,
+            ) for r in self.data
+        ]
+
+    def to_samples(self, copy: bool = True) -> Samples:
         """
         Concatenate all samples into a single Samples object.
-        This method breaks the original memory layout.
+
+        Parameters
+        ----------
+        copy : bool
+            When True (default) every field is copied into a contiguous array, which breaks the
+            original memory layout. When False the fields are strided views into the raw buffer,
+            which stays alive as long as any of them is referenced; call `Samples.copy` to
+            materialize them. `ts` is widened to int64 in both modes, and RHS `aux` is always
+            gathered into a (small) new array because the first auxiliary command result is
+            stored after the amplifier data.
         """
-        return Samples(
-            np.array([s.ts for s in self.samples]), np.stack([s.aux for s in self.samples]),
-            np.stack([s.amp for s in self.samples]), np.stack([s.adc for s in self.samples]),
-            np.stack([s.ttlin for s in self.samples]), np.stack([s.ttlout for s in self.samples]),
-            None if self.samples[0].dac is None else np.stack([s.dac for s in self.samples]),
-            None if self.samples[0].dac is None else np.stack([s.stim for s in self.samples]),
-            len(self.samples)
-        )
+        d = self.data
+        if self.rhs:
+            aux = np.concatenate((d['aux0'], d['aux']), axis=1)
+        else:
+            aux = np.array(d['aux']) if copy else d['aux']
+        fields = [d['amp'], d['adc'], d['ttlin'], d['ttlout']]
+        fields += [d['dac'], d['stim']] if self.rhs else [None, None]
+        if copy:
+            fields = [None if f is None else np.array(f) for f in fields]
+        return Samples(d['ts'].astype(np.int64), aux, *fields, len(d))
+
+
+class BlockDecoder:
+    """
+    Incremental decoder for a continuous pipe-out stream.
+
+    Partial frames at the end of a read are carried over to the next one. When the data does not
+    start on a frame boundary (e.g. after a USB or FIFO glitch) the decoder searches for the next
+    header magic and realigns instead of failing; the skipped bytes are counted in
+    `discarded_bytes` and every realignment in `resyncs`. A frame is only accepted when the next
+    header magic sits exactly one frame later (or the frame ends the buffer), so a frame that lost
+    its tail together with the next header is dropped and counted in `corrupt_frames`.
+    """
+
+    def __init__(self, rhs: bool, datastreams: int, mode32DIO: bool):
+        self.rhs = rhs
+        self.dtype = sample_dtype(rhs, datastreams, mode32DIO)
+        self._magic = _header_magic(rhs)
+        self._magic_raw = struct.pack('<Q', self._magic)
+        self._magic_bytes = np.frombuffer(self._magic_raw, dtype=np.uint8)
+        self._carry = b''
+        self.discarded_bytes = 0
+        self.corrupt_frames = 0
+        self.resyncs = 0
+
+    @property
+    def pending_bytes(self) -> int:
+        """
+        Number of bytes carried over to the next `decode` call.
+        """
+        return len(self._carry)
+
+    def reset(self):
+        self._carry = b''
+
+    def find_magic(self, buffer: Union[bytes, bytearray, memoryview], start: int = 0) -> int:
+        """
+        Offset of the first header magic at or after `start`, or -1 if there is none.
+        """
+        raw = np.frombuffer(buffer, dtype=np.uint8)[start:]
+        if len(raw) < 8:
+            return -1
+        candidates = np.flatnonzero(raw[:len(raw) - 7] == self._magic_bytes[0])
+        if len(candidates) == 0:
+            return -1
+        windows = raw[candidates[:, None] + np.arange(8)]
+        hits = candidates[(windows == self._magic_bytes).all(axis=1)]
+        return int(hits[0]) + start if len(hits) > 0 else -1
+
+    def decode(self, buffer: Union[bytes, bytearray, memoryview]) -> DataBlock:
+        """
+        Decode all complete samples available after appending `buffer` to the carried bytes.
+        The returned block views `buffer` when nothing had to be carried or skipped.
+        """
+        if len(self._carry) > 0:
+            buffer = bytearray(self._carry) + buffer
+        size = self.dtype.itemsize
+        end = len(buffer)
+        pieces = []
+        pos = 0
+        while end - pos >= size:
+            n = (end - pos) // size
+            data = np.frombuffer(buffer, dtype=self.dtype, count=n, offset=pos)
+            bad = np.flatnonzero(data['magic'] != self._magic)
+            good = int(bad[0]) if len(bad) > 0 else n
+            if good == n:
+                # a frame is only trusted when the next header follows exactly one frame later
+                rest = bytes(buffer[pos + n * size:min(end, pos + n * size + 8)])
+                if rest == self._magic_raw[:len(rest)]:
+                    if len(rest) < 8 and len(rest) > 0:
+                        # the next header is incomplete, verify the last frame on the next read
+                        good -= 1
+                    pieces.append(data[:good])
+                    pos += good * size
+                    break
+            if good > 0:
+                # the frame before a broken header may have lost its tail to the same glitch
+                pieces.append(data[:good - 1])
+                pos += (good - 1) * size
+                self.corrupt_frames += 1
+            found = self.find_magic(buffer, pos + 1)
+            if found < 0:
+                # keep the last 7 bytes, they may hold the beginning of the next magic
+                skip = max(pos, end - 7)
+                self.discarded_bytes += skip - pos
+                pos = skip
+                break
+            self.discarded_bytes += found - pos
+            self.resyncs += 1
+            pos = found
+        self._carry = bytes(buffer[pos:end])
+        if len(pieces) == 0:
+            return DataBlock(np.empty(0, dtype=self.dtype), self.rhs)
+        return DataBlock(pieces[0] if len(pieces) == 1 else np.concatenate(pieces), self.rhs)
 
 
 def amplifier2mv(amp: np.array):
@@ -121,9 +121,11 @@ class Frequency:
     def get_actual(self, sample_rate: float, display_warning: bool = True) -> float:
         actual = sample_rate / np.round(sample_rate / self.target)
         if np.any(abs(actual - self.target) / self.target > 0.05) and display_warning:
-            logger.warning(
-                f"Actual testing frequency {actual:.1f}Hz is off by more than 5% from target {self.target:.1f}Hz"
-            )
+            for a, t in zip(np.atleast_1d(actual), np.atleast_1d(self.target)):
+                if abs(a - t) / t > 0.05:
+                    logger.warning(
+                        f"Actual testing frequency {a:.1f}Hz is off by more than 5% from target {t:.1f}Hz"
+                    )
         return actual
 
     def get_period(self, sample_rate: float) -> Union[int, np.ndarray]:
@@ -1,4 +1,7 @@
+import functools
 import math
+import threading
+from collections import OrderedDict
 from functools import partial
 from pathlib import Path
 from typing import Union
@@ -6,7 +9,7 @@ from typing import Union
 import numpy as np
 
 from .constants import SampleRate
-from .register import ISA, RegisterController, machinecode
+from .register import encode_many, load_isa, load_registers, machinecode
 
 
 # Returns the value of the RH1 resistor (in ohms) corresponding to a particular upper
@@ -66,6 +69,63 @@ def lowerBandwidthFromRL(rL):
     return pow(10.0, ((-b - math.sqrt(b * b - 4 * a * c)) / (2 * a)))
 
 
+class CommandListCache:
+    """
+    Least recently used cache of generated command lists. A command list only depends on the
+    generator arguments, the sample rate and the register values, so the key includes a copy of
+    the whole register bank. The register values left by the generator (e.g. the temperature
+    sensor selection of RHD) are stored as well and restored on a hit. Cached lists are read-only
+    arrays of the ISA dtype.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __call__(self, func):
+
+        @functools.wraps(func)
+        def wrapper(headstage: 'IntanHeadstage', *args, **kwargs):
+            registers = headstage.controller.registers.registers
+            key = (
+                type(headstage), func.__name__, id(headstage.isa), headstage.sample_rate, args,
+                tuple(sorted(kwargs.items())), registers.tobytes()
+            )
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+            if entry is not None:
+                cmd, after = entry
+                registers[:] = after
+                return cmd
+            cmd = np.array(func(headstage, *args, **kwargs), dtype=headstage.isa.dtype)
+            cmd.flags.writeable = False
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = (cmd, registers.copy())
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return cmd
+
+        return wrapper
+
+
+# shared by all headstage drivers, XDAQ creates a new driver for most operations
+command_lists = CommandListCache()
+
+
 class IntanHeadstage:
 
     def __init__(
@@ -74,9 +134,10 @@ class IntanHeadstage:
         register_config: Union[str, Path],
         isa_config: Union[str, Path],
     ):
-        self.controller = RegisterController.from_json(Path(register_config).read_text())
-        self.isa = ISA.from_json(Path(isa_config).read_text())
+        self.controller = load_registers(register_config)
+        self.isa = load_isa(isa_config)
         self.encode = partial(machinecode, isa=self.isa, registers=self.controller.registers)
+        self.encode_many = partial(encode_many, isa=self.isa, registers=self.controller.registers)
         self.sample_rate = sample_rate
 
     @classmethod
@@ -199,6 +260,7 @@ class IntanHeadstage:
 
         return actualLowerBandwidth, rLDac1, rLDac2, rLDac3
 
+    @command_lists
     def get_zcheck_cmds(self, frequency: float, amplitude: float, register: int, maxlength: int):
         if (amplitude < 0.0) or (amplitude > 128.0):
             raise ValueError("Amplitude out of range.")
@@ -210,9 +272,11 @@ class IntanHeadstage:
             )
 
         if frequency == 0.0:
-            return [
-                self.encode('writeval', addr=register, value=int(math.floor(amplitude)))
-            ] * maxlength
+            return np.full(
+                maxlength,
+                self.encode('writeval', addr=register, value=int(math.floor(amplitude))),
+                dtype=self.isa.dtype
+            )
         else:
             period = round(self.sample_rate.rate / frequency)
             if period > maxlength:
@@ -220,4 +284,4 @@ class IntanHeadstage:
 
             x = np.sin(np.linspace(0, 2 * np.pi, period)) * amplitude + 128
             x = np.clip(np.round(x), 0, 255)
-            return [self.encode('writeval', addr=register, value=v) for v in map(int, x)]
+            return self.encode_many('writeval', addr=register, value=x.astype(int))
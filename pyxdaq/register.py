@@ -1,5 +1,8 @@
+import copy
 from dataclasses import dataclass
 from enum import Enum
+from functools import lru_cache
+from pathlib import Path
 from typing import Dict, List, Union
 
 import numpy as np
@@ -23,6 +26,11 @@ class Registers:
     def __iter__(self):
         return iter(self.registers)
 
+    def copy(self) -> 'Registers':
+        other = copy.copy(self)
+        other.registers = self.registers.copy()
+        return other
+
     def setbits(self, reg, value, start, *, end=None, bits=None):
         if bits is None:
             if end is None:
@@ -111,6 +119,15 @@ class RegisterController(JSONWizard):
         nr = self.named_registers_dict[name]
         return self.registers.getbits(nr.reg, nr.start, bits=nr.bits)
 
+    def copy(self) -> 'RegisterController':
+        """
+        Controller sharing the (read-only) named register definitions with an independent copy
+        of the register values.
+        """
+        other = copy.copy(self)
+        other.registers = self.registers.copy()
+        return other
+
 
 class OperandType(Enum):
     ADDRESS = 'ADDRESS'
@@ -142,6 +159,26 @@ class Operation(JSONWizard):
     operands: List[Operand]
 
 
+class CompiledOperation:
+    """
+    Operation flattened into its constant bits (opcode and immediates) and the shift of each
+    operand supplied when encoding.
+    """
+
+    def __init__(self, op: Operation, opcode_bits: int, instruction_bits: int):
+        shift = instruction_bits - opcode_bits
+        self.base = op.opcode << shift
+        self.operands = []
+        for o in op.operands:
+            shift -= o.bits
+            if o.type == OperandType.IMMEDIATE:
+                self.base |= o.value << shift
+            elif o.type in (OperandType.ADDRESS, OperandType.REGISTER, OperandType.VARIABLE):
+                self.operands.append((o.name, o.type, shift))
+            else:
+                raise ValueError(f'Invalid operand type {o.type}')
+
+
 @dataclass
 class ISA(JSONWizard):
     operations: Dict[str, Operation]
@@ -152,6 +189,10 @@ class ISA(JSONWizard):
     def __post_init__(self):
         if self.dtype is None:
             self.dtype = np.dtype(f'<u{self.instruction_bits//8}')
+        self.compiled = {
+            name: CompiledOperation(op, self.opcode_bits, self.instruction_bits)
+            for name, op in self.operations.items()
+        }
 
     def __iter__(self):
         return iter(self.operations)
@@ -161,30 +202,64 @@ class ISA(JSONWizard):
 
 
 def machinecode(opname: str, isa: ISA, registers: Registers, **kwargs):
-    op = isa[opname]
-    shift = isa.instruction_bits - isa.opcode_bits
-    binary = (op.opcode << shift)
-    for o in op.operands:
-        shift -= o.bits
-        if o.type == OperandType.ADDRESS:
-            if o.name not in kwargs:
-                raise ValueError(f'Address operand {o.name} not specified')
-            binary |= kwargs[o.name] << shift
-        elif o.type == OperandType.IMMEDIATE:
-            binary |= o.value << shift
-        elif o.type == OperandType.REGISTER:
-            if o.name not in kwargs:
-                raise ValueError(f'Register operand {o.name} not specified')
-            binary |= registers[kwargs[o.name]] << shift
-        elif o.type == OperandType.VARIABLE:
-            if o.name not in kwargs:
-                raise ValueError(f'Variable operand {o.name} not specified')
-            binary |= kwargs[o.name] << shift
-        else:
-            raise ValueError(f'Invalid operand type {o.type}')
+    op = isa.compiled[opname]
+    binary = op.base
+    for name, type, shift in op.operands:
+        if name not in kwargs:
+            raise ValueError(f'{type.value.capitalize()} operand {name} not specified')
+        value = kwargs[name]
+        if type == OperandType.REGISTER:
+            value = int(registers[value])
+        binary |= value << shift
 
     if binary >= (1 << isa.instruction_bits):
         raise ValueError(
             f'Overflow occurred when encoding {opname} with {kwargs}, {binary:b}>={1 << isa.instruction_bits:b}'
         )
     return binary
+
+
+def encode_many(opname: str, isa: ISA, registers: Registers, **kwargs) -> np.ndarray:
+    """
+    Vectorized machinecode, the operands are arrays (or scalars) broadcast against each other,
+    e.g. all the addresses of a register dump or all the samples of a waveform. Returns the
+    packed instructions as an array of isa.dtype.
+    """
+    op = isa.compiled[opname]
+    binary = np.uint64(op.base)
+    for name, type, shift in op.operands:
+        if name not in kwargs:
+            raise ValueError(f'{type.value.capitalize()} operand {name} not specified')
+        value = np.asarray(kwargs[name])
+        if type == OperandType.REGISTER:
+            value = registers[value]
+        binary = binary | (value.astype(np.uint64) << np.uint64(shift))
+    binary = np.asarray(binary)
+    if binary.size > 0 and binary.max() >= (1 << isa.instruction_bits):
+        raise ValueError(f'Overflow occurred when encoding {opname} with {kwargs}')
+    return binary.astype(isa.dtype)
+
+
+@lru_cache(maxsize=None)
+def _load_register_template(path: Path) -> RegisterController:
+    return RegisterController.from_json(path.read_text())
+
+
+def load_registers(path: Union[str, Path]) -> RegisterController:
+    """
+    Register controller with the default values of the config at `path`, the config is parsed
+    once per process and every call returns an independent copy.
+    """
+    return _load_register_template(Path(path).resolve()).copy()
+
+
+@lru_cache(maxsize=None)
+def _load_isa(path: Path) -> ISA:
+    return ISA.from_json(path.read_text())
+
+
+def load_isa(path: Union[str, Path]) -> ISA:
+    """
+    Instruction set of the config at `path`, parsed once per process and shared by all callers.
+    """
+    return _load_isa(Path(path).resolve())
@@ -1,5 +1,5 @@
 from .constants import SampleRate
-from .intan_headstage import IntanHeadstage
+from .intan_headstage import IntanHeadstage, command_lists
 
 
 class RHDDriver(IntanHeadstage):
@@ -51,6 +51,7 @@ class RHDDriver(IntanHeadstage):
         self.controller.set('rLDac3', rLDac3)
         return actural
 
+    @command_lists
     def createCommandListUpdateDigOut(self):
         cmd = []
         self.controller.set('tempEnable', 1)
@@ -74,6 +75,7 @@ class RHDDriver(IntanHeadstage):
         cmd.extend([i] * 105)
         return cmd
 
+    @command_lists
     def createCommandListTempSensor(self):
         cmd = []
         # auxiliary channels (accelerometer)
@@ -109,17 +111,18 @@ class RHDDriver(IntanHeadstage):
 
         return cmd
 
+    @command_lists
     def createCommandListRegisterConfig(self, calibrate: bool):
         cmd = []
         cmd.extend([self.encode('dummy')] * 2)
-        cmd.extend(self.encode('write', addr=addr) for addr in [0, 1, 2, 4, 5])
-        cmd.extend(self.encode('write', addr=addr) for addr in range(7, 18))
-        cmd.extend(self.encode('read', addr=addr) for addr in [63, 62, 61, 60, 59])
-        cmd.extend(self.encode('read', addr=addr) for addr in range(48, 56))
-        cmd.extend(self.encode('read', addr=addr) for addr in range(40, 45))
-        cmd.extend(self.encode('read', addr=addr) for addr in range(0, 18))
+        cmd.extend(self.encode_many('write', addr=[0, 1, 2, 4, 5]))
+        cmd.extend(self.encode_many('write', addr=range(7, 18)))
+        cmd.extend(self.encode_many('read', addr=[63, 62, 61, 60, 59]))
+        cmd.extend(self.encode_many('read', addr=range(48, 56)))
+        cmd.extend(self.encode_many('read', addr=range(40, 45)))
+        cmd.extend(self.encode_many('read', addr=range(0, 18)))
         cmd.append(self.encode('calibrate') if calibrate else self.encode('dummy'))
-        cmd.extend(self.encode('write', addr=addr) for addr in range(18, 22))
+        cmd.extend(self.encode_many('write', addr=range(18, 22)))
         cmd.extend([self.encode('dummy')] * (128 - len(cmd)))
         return cmd
 
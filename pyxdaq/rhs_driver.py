@@ -1,9 +1,9 @@
-from typing import Union
+from typing import Sequence, Union
 
 import numpy as np
 
 from .constants import SampleRate, StimStepSize
-from .intan_headstage import IntanHeadstage
+from .intan_headstage import IntanHeadstage, command_lists
 
 
 def _pack_instructions(func):
@@ -70,6 +70,7 @@ class RHSDriver(IntanHeadstage):
             return 7, 3
         return 4, 2
 
+    @command_lists
     @_pack_instructions
     def createCommandListRegisterConfig(self, update_stim: bool, readonly: bool):
         cmd = []
@@ -77,30 +78,30 @@ class RHSDriver(IntanHeadstage):
         if readonly:
             cmd.extend([self.encode('dummy')] * 54)
         else:
-            cmd.extend(self.encode('write', addr=addr) for addr in [0, 1, 2])
-            cmd.extend(self.encode('write', addr=addr) for addr in range(4, 9))
-            cmd.extend(self.encode('write', addr=addr) for addr in [10, 12, 32, 33])
+            cmd.extend(self.encode_many('write', addr=[0, 1, 2]))
+            cmd.extend(self.encode_many('write', addr=range(4, 9)))
+            cmd.extend(self.encode_many('write', addr=[10, 12, 32, 33]))
             if update_stim:
-                cmd.extend(self.encode('write', addr=addr) for addr in [34, 35, 36, 37])
+                cmd.extend(self.encode_many('write', addr=[34, 35, 36, 37]))
             else:
                 cmd.extend([self.encode('dummy')] * 4)
             cmd.append(self.encode('write', addr=38))
             cmd.append(self.encode('writem', addr=40))
-            cmd.extend(self.encode('write', addr=addr) for addr in [42, 44, 46, 48])
+            cmd.extend(self.encode_many('write', addr=[42, 44, 46, 48]))
             if update_stim:
-                cmd.extend(self.encode('write', addr=addr) for addr in range(64, 80))
-                cmd.extend(self.encode('write', addr=addr) for addr in range(96, 111))
+                cmd.extend(self.encode_many('write', addr=range(64, 80)))
+                cmd.extend(self.encode_many('write', addr=range(96, 111)))
                 cmd.append(self.encode('writeu', addr=111))
             else:
                 cmd.extend([self.encode('dummy')] * 32)
 
-        cmd.extend(self.encode('read', addr=addr) for addr in [255, 254, 253, 252, 251])
-        cmd.extend(self.encode('read', addr=addr) for addr in range(0, 9))
-        cmd.extend(self.encode('read', addr=addr) for addr in [10, 12])
-        cmd.extend(self.encode('read', addr=addr) for addr in range(32, 39))
-        cmd.extend(self.encode('read', addr=addr) for addr in [40, 42, 44, 46, 48, 50])
-        cmd.extend(self.encode('read', addr=addr) for addr in range(64, 80))
-        cmd.extend(self.encode('read', addr=addr) for addr in range(96, 112))
+        cmd.extend(self.encode_many('read', addr=[255, 254, 253, 252, 251]))
+        cmd.extend(self.encode_many('read', addr=range(0, 9)))
+        cmd.extend(self.encode_many('read', addr=[10, 12]))
+        cmd.extend(self.encode_many('read', addr=range(32, 39)))
+        cmd.extend(self.encode_many('read', addr=[40, 42, 44, 46, 48, 50]))
+        cmd.extend(self.encode_many('read', addr=range(64, 80)))
+        cmd.extend(self.encode_many('read', addr=range(96, 112)))
         if readonly:
             cmd.append(self.encode('dummy'))
         else:
@@ -108,9 +109,8 @@ class RHSDriver(IntanHeadstage):
         cmd.extend([self.encode('dummy')] * 10)
         return cmd
 
-    @_pack_instructions
     def dummy(self, n):
-        return [self.encode('dummy')] * n
+        return np.full(n, self.encode('dummy'), dtype=self.isa.dtype)
 
     @_pack_instructions
     def createCommandListZcheckDac(self, frequency: float, amplitude: float):
@@ -119,16 +119,17 @@ class RHSDriver(IntanHeadstage):
     @_pack_instructions
     def createCommandListSetStimMagnitudes(
         self, magnitude_neg: Union[int, np.ndarray], magnitude_pos: Union[int, np.ndarray],
-        channel: int
+        channel: Union[int, Sequence[int], None]
     ):
         cmd = [self.encode('dummy')] * 2
-        if channel is None:
-            pass
-        else:
+        channels = [] if channel is None else [int(c) for c in np.atleast_1d(channel)]
+        magnitude_neg = np.broadcast_to(magnitude_neg, len(channels))
+        magnitude_pos = np.broadcast_to(magnitude_pos, len(channels))
+        for channel, neg, pos in zip(channels, magnitude_neg, magnitude_pos):
             self.controller.set(f'negativeCurrentTrim{channel}', 0x80)
             self.controller.set(f'positiveCurrentTrim{channel}', 0x80)
-            self.controller.set(f'negativeCurrentMagnitude{channel}', magnitude_neg)
-            self.controller.set(f'positiveCurrentMagnitude{channel}', magnitude_pos)
+            self.controller.set(f'negativeCurrentMagnitude{channel}', int(neg))
+            self.controller.set(f'positiveCurrentMagnitude{channel}', int(pos))
             cmd.append(self.encode('writeu', addr=96 + channel))
             cmd.append(self.encode('writeu', addr=64 + channel))
 
@@ -0,0 +1,515 @@
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Union
+
+import numpy as np
+
+from .board import OkBoard
+from .constants import FIFOMAX, RHD, RHS, HeadstageChipID, HeadstageChipMISOID, SampleRate
+from .datablock import _header_magic, sample_dtype
+from . import resources
+
+# generation granularity, bounds the temporary memory of long bounded runs
+_GENERATE_SAMPLES = 8192
+_NOISE_TABLE = 8191
+# zcheckScale -> series capacitor, the third setting is used for 10 pF as in measure_impedance
+_ZCHECK_CAPS = np.array([0.1e-12, 1e-12, 10e-12, 10e-12])
+
+
+class SimulatedFrontPanel:
+    """
+    Software model of the XDAQ gateware behind the subset of the okCFrontPanel API used by
+    OkBoard, see SimulatedBoard.
+
+    Modelled:
+    - host buffered wire-ins (UpdateWireIns) and a wire-out snapshot (UpdateWireOuts)
+    - trigger-ins for the sample clock, the sequencer, the aux command RAM and stim registers
+    - the aux command RAM (RHD: 3 slots x 16 banks selected per SPI port, RHS: 4 slots), the
+      command loop/end indices and the run / continuous / MaxTimeStep sequencer
+    - the USB FIFO with pipe out throttling, filled in real time at the sample rate
+    - headstages answering the aux commands: register writes and reads with a one sample
+      delay, the chip ROM (name, chip ID, MISO ID) and the impedance test DAC (zcheck), whose
+      injected current shows up on the selected amplifier channel as if the electrode had
+      `impedance` ohms
+    - synthetic amplifier signals, one sine per channel plus noise
+
+    Parameters
+    ----------
+    rhs : bool
+        Gateware to emulate, None to follow the bitfile passed to ConfigureFPGA.
+    chips : Dict[int, HeadstageChipID]
+        Connected chips by chip index (RHD: data stream // 2, RHS: data stream), defaults to one
+        RHD2164 or RHS2116 on the first SPI port.
+    cable_delay : int
+        First MISO sampling delay returning valid data, the next two delays are valid as well.
+    impedance : float
+        Electrode impedance in ohms seen by the zcheck current.
+    signal : float
+        Amplitude of the synthetic amplifier signals in uV.
+    noise : float
+        RMS noise added to the amplifier signals in uV.
+    realtime : bool
+        When False, bounded runs (MaxTimeStep) complete as soon as they are started, continuous
+        runs are always paced by the sample clock.
+    timeout : float
+        Seconds a throttled pipe out read waits for data before returning Timeout.
+    """
+
+    NoError = 0
+    Failed = -1
+    Timeout = -2
+
+    def __init__(
+        self,
+        rhs: bool = None,
+        chips: Dict[int, HeadstageChipID] = None,
+        cable_delay: int = 1,
+        impedance: float = 1e6,
+        signal: float = 100,
+        noise: float = 5,
+        realtime: bool = True,
+        timeout: float = 1,
+        seed: int = 0,
+    ):
+        self.rhs = rhs
+        self.chips = chips
+        self.cable_delay = cable_delay
+        self.impedance = impedance
+        self.signal = signal
+        self.realtime = realtime
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        rng = np.random.default_rng(seed)
+        self._noise = (rng.standard_normal((_NOISE_TABLE, 64)) * noise / 0.195).astype(np.float32)
+        self._freqs = 10.0 * (1 + np.arange(64) % 16)
+        self._configured = False
+
+    def IsOpen(self) -> bool:
+        return True
+
+    def IsFrontPanelEnabled(self) -> bool:
+        return self._configured
+
+    def ConfigureFPGA(self, bitfile: str) -> int:
+        rhs = self.rhs
+        if rhs is None:
+            rhs = Path(bitfile).name == resources.rhs.bitfile_path.name
+        with self._lock:
+            self._configure(rhs)
+        return self.NoError
+
+    def _configure(self, rhs: bool):
+        self.ep = RHS if rhs else RHD
+        self.num_streams = 8 if rhs else 32
+        self.slots = 4 if rhs else 3
+        self._mode_rhs = rhs
+        chips = self.chips
+        if chips is None:
+            chips = {0: HeadstageChipID.RHS2116 if rhs else HeadstageChipID.RHD2164}
+        for chip in chips.values():
+            if (chip == HeadstageChipID.RHS2116) != rhs:
+                raise ValueError(
+                    f'{chip.name} is not supported by the {"RHS" if rhs else "RHD"} gateware'
+                )
+        self._chips = chips
+        self._regs = [self._chip_registers(s) for s in range(self.num_streams)]
+        self._host_wires = [0] * 32
+        self.wires = [0] * 32
+        self._wire_out = {}
+        self.stim_regs = {}
+        self.dac_waveforms = {}
+        self._aux_length = [0] * self.slots
+        self._aux_loop = [0] * self.slots
+        self._reset()
+        self._configured = True
+
+    def _reset(self):
+        self.ram = np.zeros(
+            (self.slots, 1, 8192) if self._mode_rhs else (self.slots, 16, 1024),
+            dtype=np.uint32 if self._mode_rhs else np.uint16
+        )
+        self._ram_addr = [0] * self.slots
+        self.sample_rate = SampleRate.SampleRate30000Hz
+        self._fifo = bytearray()
+        self._pending = 0
+        self.running = False
+        self.overflow = 0
+        self._reset_sequencers()
+
+    def _reset_sequencers(self):
+        self._ts = 0
+        self._pos = [0] * self.slots
+        shape = (self.num_streams, self.slots) + ((2,) if self._mode_rhs else ())
+        self._carry = np.zeros(shape, dtype=np.uint16)
+        self._last_dac = np.full(self.num_streams, 128, dtype=np.int64)
+
+    def _chip(self, stream: int):
+        """
+        Chip and MISO line (0 = A, 1 = B) behind a data stream, chip is None when nothing answers.
+        """
+        if self._mode_rhs:
+            return self._chips.get(stream), 0
+        chip = self._chips.get(stream // 2)
+        miso = stream % 2
+        if miso == 1 and chip != HeadstageChipID.RHD2164:
+            return None, 1
+        return chip, miso
+
+    def _chip_registers(self, stream: int) -> np.ndarray:
+        chip, miso = self._chip(stream)
+        if self._mode_rhs:
+            regs = np.zeros(256, dtype=np.int64)
+            if chip is not None:
+                regs[251] = ord('I') << 8 | ord('N')
+                regs[252] = ord('T') << 8 | ord('A')
+                regs[253] = ord('N') << 8
+                regs[254] = chip.num_channels()
+                regs[255] = chip.value
+            return regs
+        regs = np.zeros(64, dtype=np.int64)
+        if chip is not None:
+            regs[40:45] = list(b'INTAN')
+            regs[48:51] = list(b'RHD')
+            if chip == HeadstageChipID.RHD2164:
+                regs[59] = (
+                    HeadstageChipMISOID.MISO_B if miso else HeadstageChipMISOID.MISO_A
+                ).value
+            regs[61] = 1
+            regs[62] = chip.num_channels()
+            regs[63] = chip.value
+        return regs
+
+    def _rom(self, addr: np.ndarray) -> np.ndarray:
+        if self._mode_rhs:
+            return (addr >= 251) | ((addr >= 40) & (addr <= 50))
+        return addr >= 40
+
+    def _continuous(self) -> bool:
+        return bool(self.wires[self.ep.WireInResetRun.value] & 0x2)
+
+    def _throttled(self) -> bool:
+        return not (self.wires[self.ep.WireInResetRun.value] >> 16) & 1
+
+    def _sample_size(self) -> int:
+        return self._dtype().itemsize
+
+    def _dtype(self) -> np.dtype:
+        mode32DIO = not self._mode_rhs and bool(self.wires[self.ep.Enable32bitDIO.value] & 0x04)
+        return sample_dtype(self._mode_rhs, len(self._streams()), mode32DIO)
+
+    def _streams(self):
+        enabled = self.wires[self.ep.WireInDataStreamEn.value]
+        return [s for s in range(self.num_streams) if enabled >> s & 1]
+
+    def _advance(self):
+        """
+        Count the samples the sequencer produced since the last call, the frames are generated
+        lazily by _materialize so polling the FIFO stays cheap.
+        """
+        if not self.running:
+            return
+        max_time_step = self.wires[self.ep.WireInMaxTimeStep.value]
+        continuous = self._continuous()
+        if self.realtime or continuous:
+            due = int((time.perf_counter() - self._t0) * self.sample_rate.rate)
+        else:
+            due = max_time_step
+        if not continuous:
+            due = min(due, max_time_step)
+        if due > self._produced:
+            self._pending += due - self._produced
+            self._produced = due
+        if not continuous and self._produced >= max_time_step:
+            self.running = False
+
+    def _materialize(self):
+        while self._pending > 0:
+            n = min(self._pending, _GENERATE_SAMPLES)
+            self._pending -= n
+            frames = self._generate(n)
+            keep = min(n, (FIFOMAX * 2 - len(self._fifo)) // frames.itemsize)
+            self.overflow += n - keep
+            self._fifo += frames[:keep].tobytes()
+
+    def _positions(self, slot: int, n: int) -> np.ndarray:
+        if self._mode_rhs:
+            end, loop = self._aux_length[slot], self._aux_loop[slot]
+        else:
+            end = self.wires[self.ep.WireInAuxCmdLength.value] >> (10 * slot) & 0x3ff
+            loop = self.wires[self.ep.WireInAuxCmdLoop.value] >> (10 * slot) & 0x3ff
+        loop = min(loop, end)
+        x = self._pos[slot] + np.arange(n + 1)
+        wrap = x > end
+        x[wrap] = loop + (x[wrap] - loop) % (end - loop + 1)
+        self._pos[slot] = int(x[-1])
+        return x[:-1]
+
+    def _generate(self, n: int) -> np.ndarray:
+        rhs = self._mode_rhs
+        streams = self._streams()
+        data = np.zeros(n, dtype=self._dtype())
+        data['magic'] = _header_magic(rhs)
+        ts = self._ts + np.arange(n, dtype=np.int64)
+        data['ts'] = ts & 0xffffffff
+        self._ts += n
+        positions = [self._positions(slot, n) for slot in range(self.slots)]
+        t = ts / self.sample_rate.rate
+        base = np.sin(2 * np.pi * t[:, None] * self._freqs[None, :]) * (self.signal / 0.195)
+        for j, stream in enumerate(streams):
+            self._generate_stream(data, j, stream, positions, ts, base)
+        data['adc'] = 32768
+        if rhs:
+            data['dac'] = 32768
+        else:
+            ttlout = self.wires[self.ep.WireInTtlOut.value] & 0xffff
+            if data.dtype['ttlout'].base.itemsize == 4:
+                ttlout |= (self.wires[self.ep.WireInTtlOut32.value] & 0xffff) << 16
+            data['ttlout'] = ttlout
+        return data
+
+    def _generate_stream(self, data, j, stream, positions, ts, base):
+        chip, miso = self._chip(stream)
+        if chip is None:
+            return
+        rhs = self._mode_rhs
+        n = len(ts)
+        if rhs:
+            banks = [0] * self.slots
+        else:
+            spi = stream // 4
+            banks = [
+                self.wires[self.ep.WireInAuxCmdBank1.value + slot] >> (4 * spi) & 0xf
+                for slot in range(self.slots)
+            ]
+        cmds = np.stack(
+            [self.ram[slot, banks[slot], positions[slot]] for slot in range(self.slots)], axis=1
+        ).astype(np.int64).ravel()
+        resp, lookup = self._execute(self._regs[stream], cmds)
+        resp = resp.reshape((n, self.slots) + ((2,) if rhs else ()))
+        aux = np.concatenate((self._carry[stream][None], resp[:-1]))
+        self._carry[stream] = resp[-1]
+
+        delay = self.wires[self.ep.WireInMisoDelay.value] >> (4 * (stream // (2 if rhs else 4)))
+        if not self.cable_delay <= delay & 0xf < self.cable_delay + 3:
+            # sampling MISO at the wrong time, nothing useful comes back
+            return
+
+        channels = 16 if rhs else 32
+        first = 32 * miso
+        amp = base[:, first:first + channels] + self._noise[(ts + 1031 * stream) % _NOISE_TABLE,
+                                                            first:first + channels]
+        self._zcheck(stream, lookup, n, amp, first)
+        amp = np.clip(np.round(amp) + 32768, 0, 65535)
+        if rhs:
+            data['aux0'][:, 0, j] = aux[:, 0]
+            data['aux'][:, :, j] = aux[:, 1:]
+            data['amp'][:, :, j, 0] = 512
+            data['amp'][:, :, j, 1] = amp
+        else:
+            data['aux'][:, :, j] = aux
+            data['amp'][:, :, j] = amp
+
+    def _execute(self, regs: np.ndarray, cmds: np.ndarray):
+        """
+        Run a sequence of aux commands against one chip, returns the SPI results and a
+        `lookup(addr, k)` function giving register values as they were before command k.
+        """
+        if self._mode_rhs:
+            op, addr, value = cmds >> 30, cmds >> 16 & 0xff, cmds & 0xffff
+        else:
+            op, addr, value = cmds >> 14, cmds >> 8 & 0x3f, cmds & 0xff
+        k = np.arange(len(cmds))
+        write = (op == 2) & ~self._rom(addr)
+        order = np.lexsort((k[write], addr[write]))
+        waddr, wvalue = addr[write][order], value[write][order]
+        keys = waddr * len(cmds) + k[write][order]
+
+        def lookup(qaddr, qk):
+            pos = np.searchsorted(keys, qaddr * len(cmds) + qk) - 1
+            hit = pos >= 0
+            hit[hit] = waddr[pos[hit]] == qaddr[hit]
+            out = regs[qaddr]
+            out[hit] = wvalue[pos[hit]]
+            return out
+
+        read = op == 3
+        if self._mode_rhs:
+            resp = np.zeros((len(cmds), 2), dtype=np.uint16)
+            resp[op == 2, 0] = value[op == 2]
+            resp[op == 2, 1] = 0xffff
+            resp[read, 0] = lookup(addr[read], k[read])
+            resp[op == 0, 1] = 0x8000
+        else:
+            resp = np.zeros(len(cmds), dtype=np.uint16)
+            resp[op == 2] = 0xff00 | value[op == 2]
+            resp[read] = lookup(addr[read], k[read])
+            resp[op == 0] = 0x8000
+        if len(keys) > 0:
+            last = np.append(waddr[1:] != waddr[:-1], True)
+            regs[waddr[last]] = wvalue[last]
+        return resp, lookup
+
+    def _zcheck(self, stream: int, lookup, n: int, amp: np.ndarray, first: int):
+        """
+        Add the response to the impedance test current, I = C dV/dt through `impedance` ohms.
+        """
+        k = (np.arange(n) + 1) * self.slots
+        if self._mode_rhs:
+            config = lookup(np.full(n, 2), k)
+            enable, scale, select = config & 1, config >> 3 & 3, config >> 8 & 0x3f
+            dac = lookup(np.full(n, 3), k) & 0xff
+        else:
+            config = lookup(np.full(n, 5), k)
+            enable, scale = config & 1, config >> 3 & 3
+            select = lookup(np.full(n, 7), k) & 0x3f
+            dac = lookup(np.full(n, 6), k) & 0xff
+        dv = np.diff(dac, prepend=self._last_dac[stream]) * (1.225 / 256)
+        self._last_dac[stream] = dac[-1]
+        channel = select - first
+        active = (enable == 1) & (channel >= 0) & (channel < amp.shape[1])
+        if not active.any():
+            return
+        current = _ZCHECK_CAPS[scale] * dv * self.sample_rate.rate
+        # calculate_impedance scales RHS results by 1.1
+        uv = current * self.impedance * 1e6 / (1.1 if self._mode_rhs else 1)
+        t = np.nonzero(active)[0]
+        amp[t, channel[t]] += uv[t] / 0.195
+
+    def SetWireInValue(self, epAddr: int, value: int, mask: int = 0xffffffff) -> int:
+        with self._lock:
+            self._host_wires[epAddr] = (self._host_wires[epAddr] & ~mask) | (value & mask)
+        return self.NoError
+
+    def UpdateWireIns(self) -> int:
+        with self._lock:
+            self._advance()
+            self._materialize()
+            reset = self.ep.WireInResetRun.value
+            rising = self._host_wires[reset] & ~self.wires[reset]
+            self.wires = list(self._host_wires)
+            if rising & 0x1:
+                self._reset()
+            if self.wires[reset] >> 17 & 1:
+                self._fifo.clear()
+        return self.NoError
+
+    def UpdateWireOuts(self) -> int:
+        with self._lock:
+            self._advance()
+            words = (len(self._fifo) + self._pending * self._sample_size()) // 2
+            self._wire_out = {
+                self.ep.WireOutNumWords.value: min(words, 0xffffffff),
+                self.ep.WireOutSpiRunning.value: int(self.running),
+                self.ep.WireOutDataClkLocked.value: 0x3,
+                self.ep.WireOutBoardId.value: 800 if self._mode_rhs else 500,
+                self.ep.WireOutBoardVersion.value: 2024060601,
+                0x30: 16 << 24 | 16 << 16 | 8 << 8 | 8,
+                0x31: 16 << 24 | 8 << 16 | 3 << 8,
+                0x32: 0x51a0,
+            }
+        return self.NoError
+
+    def GetWireOutValue(self, epAddr: int) -> int:
+        return self._wire_out.get(epAddr, 0)
+
+    def ActivateTriggerIn(self, epAddr: int, bit: int) -> int:
+        with self._lock:
+            self._advance()
+            self._materialize()
+            self._trigger(epAddr, bit)
+        return self.NoError
+
+    def _trigger(self, epAddr: int, bit: int):
+        ep, w = self.ep, self.wires
+        if epAddr == ep.TrigInConfig.value and bit == 0:
+            pll = w[ep.WireInDataFreqPll.value]
+            for rate in SampleRate:
+                if rate.value[:2] == (pll >> 8, pll & 0xff):
+                    self.sample_rate = rate
+        elif epAddr == ep.TrigInConfig.value and not self._mode_rhs and 1 <= bit <= 3:
+            self.ram[bit - 1, w[ep.WireInCmdRamBank.value] & 0xf,
+                     w[ep.WireInCmdRamAddr.value] & 0x3ff] = w[ep.WireInCmdRamData.value] & 0xffff
+        elif epAddr == ep.TrigInSpiStart.value and bit == 0:
+            if not self.running:
+                self.running = True
+                self._t0 = time.perf_counter()
+                self._produced = 0
+        elif epAddr == ep.TrigInSpiStart.value and bit == 1:
+            self._reset_sequencers()
+        elif self._mode_rhs and epAddr == RHS.TrigInRamAddrReset.value:
+            if bit == 0:
+                self._ram_addr = [0] * self.slots
+            elif bit == 1:
+                addr = w[RHS.WireInStimRegAddr.value]
+                key = (addr >> 8 & 0x1f, addr >> 4 & 0xf, addr & 0xf)
+                self.stim_regs[key] = w[RHS.WireInStimRegWord.value] & 0xffff
+        elif self._mode_rhs and epAddr == RHS.TrigInAuxCmdLength.value:
+            value = w[RHS.WireInMultiUse.value] & 0x1fff
+            if bit < 4:
+                self._aux_length[bit] = value
+            else:
+                self._aux_loop[bit - 4] = value
+
+    def WriteToBlockPipeIn(self, epAddr: int, blockSize: int, data: bytearray) -> int:
+        with self._lock:
+            self._advance()
+            self._materialize()
+            aux_pipes = [RHS.PipeInAuxCmd1, RHS.PipeInAuxCmd2, RHS.PipeInAuxCmd3, RHS.PipeInAuxCmd4]
+            dac_pipes = [getattr(self.ep, f'PipeInDAC{i + 1}').value for i in range(8)]
+            if self._mode_rhs and epAddr in [p.value for p in aux_pipes]:
+                slot = [p.value for p in aux_pipes].index(epAddr)
+                words = np.frombuffer(bytes(data), dtype='<u4')
+                addr = (self._ram_addr[slot] + np.arange(len(words))) % self.ram.shape[2]
+                self.ram[slot, 0, addr] = words
+                self._ram_addr[slot] = int(addr[-1]) + 1 if len(words) else self._ram_addr[slot]
+            elif epAddr in dac_pipes:
+                self.dac_waveforms[dac_pipes.index(epAddr)] = np.frombuffer(
+                    bytes(data), dtype='<u2'
+                ).copy()
+            else:
+                return self.Failed
+        return len(data)
+
+    def ReadFromBlockPipeOut(self, epAddr: int, blockSize: int, data: bytearray) -> int:
+        if epAddr != self.ep.PipeOutData.value:
+            return self.Failed
+        n = len(data)
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            with self._lock:
+                self._advance()
+                self._materialize()
+                available = len(self._fifo)
+                if available >= n or not self._throttled():
+                    k = min(n, available)
+                    with memoryview(data) as out, memoryview(self._fifo) as fifo:
+                        out[:k] = fifo[:k]
+                        out[k:] = bytes(n - k)
+                    del self._fifo[:k]
+                    return n
+                if not self.running or time.perf_counter() > deadline:
+                    return self.Timeout
+                wait = (n - available) / self._sample_size() / self.sample_rate.rate
+            time.sleep(min(max(wait, 0.0001), 0.01))
+
+
+class SimulatedBoard(OkBoard):
+    """
+    Board backed by SimulatedFrontPanel instead of an Opal Kelly device, the whole stack runs
+    without the FrontPanel library or hardware. Keyword arguments are passed to
+    SimulatedFrontPanel, the model is available as `sim`.
+
+    Example:
+        xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False))
+    """
+
+    def __init__(self, debug: Union[bool, Callable] = False, profile: bool = False, **kwargs):
+        self.sim = SimulatedFrontPanel(**kwargs)
+        super().__init__(debug, self.sim, profile)
+
+    def config_fpga(self, bitfile: Union[str, Path]):
+        self.reset_host_state()
+        error_code = self.dev.ConfigureFPGA(str(bitfile))
+        if error_code != SimulatedFrontPanel.NoError:
+            raise RuntimeError(f'Configure FPGA failed {error_code}')
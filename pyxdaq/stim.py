@@ -1,8 +1,12 @@
+from typing import Sequence
+
 from .xdaq import XDAQ
-from .constants import StartPolarity, StimShape, TriggerEvent, TriggerPolarity, StimStepSize
+from .constants import (
+    StartPolarity, StimRegister, StimShape, TriggerEvent, TriggerPolarity, StimStepSize
+)
 
 
-def enable_stim(
+def stim_settings(
     xdaq: XDAQ,
     *,
     # channel settings
@@ -29,7 +33,11 @@ def enable_stim(
     post_pulse_ms: float,
     post_ampsettle_ms: float,
     post_charge_recovery_ms: float,
-):
+) -> dict:
+    """
+    Validate the stimulation settings of one channel and convert them to the keyword arguments of
+    XDAQ.set_stim, without enable.
+    """
     max_current = step_size.nA * 256
     assert 0 <= amp_neg_mA and 0 <= amp_pos_mA, 'current must be positive'
 
@@ -96,5 +104,66 @@ def enable_stim(
         'step_size': step_size,
         'post_charge_recovery_ms': post_charge_recovery_ms,
     }
+    return kwargs
+
+
+def enable_stim(xdaq: XDAQ, **settings):
+    """
+    Configure and enable the stimulation of one channel, the settings are the keyword arguments of
+    stim_settings. Returns a function disabling it.
+    """
+    kwargs = stim_settings(xdaq, **settings)
     xdaq.set_stim(**kwargs, enable=True)
     return lambda: xdaq.set_stim(**kwargs, enable=False)
+
+
+def enable_stim_many(xdaq: XDAQ, settings: Sequence[dict]):
+    """
+    Configure and enable the stimulation of many channels at once, each dict holds the keyword
+    arguments of enable_stim. The channels are committed with one set of sequencer runs instead
+    of three runs per channel, see XDAQ.set_stim_many. Returns a function disabling all of them.
+    """
+    stims = [stim_settings(xdaq, **s) for s in settings]
+    xdaq.set_stim_many(stims, enable=True)
+    return lambda: xdaq.set_stim_many(stims, enable=False)
+
+
+class StimProgram:
+    """
+    Stimulation of one or more channels compiled once and armed cheaply: the timing registers,
+    magnitude command list and register config are built at construction. The first `arm` loads
+    them, later arms and disarms only toggle the trigger-enable bit of each channel as long as
+    the chips keep the loaded config (no reset_board, aux command upload or aux command length,
+    bank or enable change in between, see XDAQ.loadStim).
+    A disarmed program keeps its magnitudes on the chips, use the handle of enable_stim_many to
+    zero them.
+
+    Example:
+        program = StimProgram(xdaq, [dict(stream=0, channel=3, ...)])
+        for _ in range(runs):
+            with program:
+                xdaq.runAndReadDataBlock(samples)
+    """
+
+    def __init__(self, xdaq: XDAQ, settings: Sequence[dict]):
+        self.xdaq = xdaq
+        self.config = xdaq.compileStim([stim_settings(xdaq, **s) for s in settings], enable=True)
+        self._disarm = [
+            # clear the enabled bit of stim_trigger
+            (stream, channel, reg, value & ~0x80)
+            for stream, channel, reg, value in self.config.rows
+            if reg == StimRegister.Trigger
+        ]
+
+    def arm(self):
+        self.xdaq.loadStim(self.config)
+
+    def disarm(self):
+        self.xdaq.programStimRegs(self._disarm)
+
+    def __enter__(self) -> 'StimProgram':
+        self.arm()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disarm()
@@ -0,0 +1,300 @@
+import queue
+import threading
+import time
+from typing import Union
+
+from .buffers import BufferPool
+from .datablock import BlockDecoder, DataBlock
+
+
+class DataStream:
+    """
+    Continuous acquisition with a dedicated thread draining PipeOutData into a fixed pool of
+    preallocated buffers, decoded blocks are handed out by iterating over the stream.
+
+    A yielded DataBlock views one of the pooled buffers and stays valid until the next block is
+    requested, copy it (e.g. `block.to_samples()`) to keep the data. Memory is bounded by
+    `buffers * chunk_samples` samples; when the consumer falls behind, the reader waits for a free
+    buffer (counted in `stalls`) and the data accumulates in the FPGA FIFO instead. Iterating
+    raises TimeoutError when no block arrives within `timeout` seconds.
+
+    The reader thread holds `lock` while talking to the board, other XDAQ calls made while
+    streaming must hold it as well.
+
+    Example:
+        with xdaq.stream() as stream:
+            for block in stream:
+                process(block.to_samples(copy=False))
+    """
+
+    def __init__(
+        self,
+        xdaq,
+        chunk_samples: int = 128 * 64,
+        buffers: int = 16,
+        timeout: Union[float, None] = None,
+    ):
+        if chunk_samples <= 0 or chunk_samples % 128 != 0:
+            raise ValueError('chunk_samples must be a positive multiple of 128')
+        if buffers < 2:
+            raise ValueError('At least 2 buffers are required')
+        self.xdaq = xdaq
+        self.chunk_samples = chunk_samples
+        # seconds to wait for the next block, by default the time to fill one chunk plus a margin
+        self.timeout = chunk_samples / xdaq.getSampleRate() + 5 if timeout is None else timeout
+        # 128 samples are always a multiple of the 1024 bytes pipe block size
+        self.chunk_bytes = xdaq.getSampleSizeBytes() * chunk_samples
+        self.lock = threading.Lock()
+        self.decoder = BlockDecoder(xdaq.rhs, xdaq.numDataStream, xdaq.mode32DIO)
+        self._free = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(bytearray(self.chunk_bytes))
+        self._filled = queue.Queue()
+        self._current = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+        self._last_ts = None
+
+        self.bytes_read = 0
+        self.samples = 0
+        self.dropped = 0
+        self.stalls = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError('Stream already started')
+        with self.lock:
+            self.xdaq.resetSequencers()
+            self.xdaq.start()
+        self._thread = threading.Thread(target=self._reader, name='pyxdaq-stream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        with self.lock:
+            self.xdaq.stop()
+            self.xdaq.waitForRunEnd()
+            self.xdaq.discardFIFO()
+
+    def _reader(self):
+        # time to fill one chunk, poll a few times per chunk to keep the FIFO low
+        poll = self.chunk_samples / self.xdaq.getSampleRate() / 4
+        try:
+            while not self._stop.is_set():
+                with self.lock:
+                    available = self.xdaq.numWordsInFifo() * 2
+                if available < self.chunk_bytes:
+                    time.sleep(poll)
+                    continue
+                try:
+                    buffer = self._free.get_nowait()
+                except queue.Empty:
+                    self.stalls += 1
+                    buffer = None
+                    while buffer is None and not self._stop.is_set():
+                        try:
+                            buffer = self._free.get(timeout=0.1)
+                        except queue.Empty:
+                            pass
+                    if buffer is None:
+                        break
+                with self.lock:
+                    n = self.xdaq.readDataToBuffer(buffer)
+                self.bytes_read += n
+                self._filled.put(buffer)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._filled.put(None)
+
+    def _release(self):
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> DataBlock:
+        self._release()
+        if self._thread is None:
+            raise RuntimeError('Stream not started')
+        try:
+            buffer = self._filled.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f'No data received within {self.timeout} seconds')
+        if buffer is None:
+            # keep the end marker for later calls
+            self._filled.put(None)
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+        self._current = buffer
+        block = self.decoder.decode(buffer)
+        res = block.check(self._last_ts)
+        self._last_ts = res.last_ts
+        self.dropped += res.dropped
+        self.samples += len(block)
+        return block
+
+    def __enter__(self) -> 'DataStream':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class BackgroundRun:
+    """
+    Bounded run of `samples` time steps with a dedicated thread draining the FIFO, the caller
+    stays free while the sequencer runs (e.g. long stimulation protocols). `progress` follows the
+    timestamp of the last sample read back from the FPGA, `cancel` stops the sequencer early and
+    discards what is left in the FIFO.
+
+    The data is dropped unless `callback` is given: it is called from the reader thread with the
+    samples whose timestamp is a multiple of `decimate`, as a DataBlock viewing a pooled buffer
+    which is only valid during the call.
+
+    As with DataStream, other XDAQ calls made during the run must hold `lock`.
+
+    Example:
+        with xdaq.runInBackground(samples) as run:
+            while not run.wait(1):
+                print(f'{run.progress:.0%}')
+    """
+
+    def __init__(
+        self,
+        xdaq,
+        samples: int,
+        chunk_samples: int = 128 * 64,
+        callback=None,
+        decimate: int = 1,
+    ):
+        if samples <= 0 or samples > 2**32 - 1:
+            raise ValueError('samples out of range')
+        if chunk_samples <= 0 or chunk_samples % 128 != 0:
+            raise ValueError('chunk_samples must be a positive multiple of 128')
+        if decimate < 1:
+            raise ValueError('decimate must be at least 1')
+        self.xdaq = xdaq
+        self.samples = samples
+        self.chunk_bytes = xdaq.getSampleSizeBytes() * chunk_samples
+        self.callback = callback
+        self.decimate = decimate
+        self.lock = threading.Lock()
+        self.decoder = BlockDecoder(xdaq.rhs, xdaq.numDataStream, xdaq.mode32DIO)
+        self._cancel = threading.Event()
+        self._thread = None
+        self._error = None
+
+        # timestamp following the last sample read back
+        self.timestamp = 0
+        self.bytes_read = 0
+        self.cancelled = False
+
+    @property
+    def progress(self) -> float:
+        return min(1.0, self.timestamp / self.samples)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError('Run already started')
+        with self.lock:
+            self.xdaq.resetSequencers()
+            self.xdaq.setMaxTimeStep(self.samples)
+            self.xdaq.setContinuousRunMode(False)
+            self.xdaq.run()
+        self._thread = threading.Thread(target=self._reader, name='pyxdaq-run', daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait for the run to end, returns False when `timeout` expired first. Errors of the reader
+        thread are raised here.
+        """
+        if self._thread is None:
+            raise RuntimeError('Run not started')
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        if self._error is not None:
+            raise self._error
+        return True
+
+    def cancel(self):
+        """
+        Stop the sequencer and discard the data left in the FIFO, returns once the board is idle.
+        """
+        if self._thread is None:
+            return
+        self._cancel.set()
+        self._thread.join()
+
+    def _reader(self):
+        poll = self.chunk_bytes / self.xdaq.getSampleSizeBytes() / self.xdaq.getSampleRate() / 4
+        try:
+            while not self._cancel.is_set():
+                with self.lock:
+                    with self.xdaq.wireOutSnapshot():
+                        fifo = self.xdaq.numWordsInFifo() * 2
+                        running = self.xdaq.is_running() > 0
+                available = fifo // 1024 * 1024
+                if running and available < self.chunk_bytes:
+                    time.sleep(poll)
+                    continue
+                if fifo == 0:
+                    break
+                # the run may end inside a pipe block, read that tail without waiting for the
+                # rest of the block
+                tail = fifo if available == 0 else None
+                # power-of-two reads keep the scratch buffers in a few pool size classes
+                n = BufferPool.chunk_size(min(available, self.chunk_bytes))
+                with self.xdaq.buffers.borrow(n) as buffer:
+                    with self.lock:
+                        if tail is None:
+                            n = self.xdaq.readDataToBuffer(buffer)
+                        else:
+                            with self.xdaq.disablePipeoutThrottle():
+                                self.xdaq.readDataToBuffer(buffer)
+                            n = tail
+                    self.bytes_read += n
+                    block = self.decoder.decode(memoryview(buffer)[:n])
+                    if len(block) == 0:
+                        continue
+                    if self.callback is not None:
+                        first = (-int(block.data['ts'][0])) % self.decimate
+                        self.callback(DataBlock(block.data[first::self.decimate], block.rhs))
+                    self.timestamp = int(block.data['ts'][-1]) + 1
+        except Exception as e:
+            self._error = e
+        finally:
+            if self._cancel.is_set() or self._error is not None:
+                self.cancelled = self.timestamp < self.samples
+                with self.lock:
+                    self.xdaq.stop()
+                    self.xdaq.waitForRunEnd()
+                    self.xdaq.discardFIFO()
+
+    def __enter__(self) -> 'BackgroundRun':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.cancel()
+        else:
+            self.wait()
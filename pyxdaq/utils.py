@@ -1,4 +1,14 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
 from subprocess import getstatusoutput
+from typing import Union
+
+import numpy as np
 
 
 def git_rev_parse(rev):
@@ -45,4 +55,131 @@ class DebugWrapper:
             )
             return getattr(self.dev, name)(*args, **kwargs)
 
-        return wrapper
\ No newline at end of file
+        return wrapper
+
+
+class ProfilingWrapper:
+    """
+    Wrap a device and record every function call: call counts, latencies and the bytes moved
+    by the block pipes. Calls are grouped by the outermost XDAQ method on the calling thread, e.g.
+    all the wire updates and triggers issued while `set_stim` runs are reported under
+    `set_stim`, together with the number of `set_stim` invocations. XDAQ registers its methods
+    with `instrument` when its board profiles; device calls made outside of them are reported
+    under '<none>'.
+
+    Example:
+        xdaq = get_XDAQ(rhs=True, dev=OkBoard(profile=True))
+        print(xdaq.dev.profiler.format())
+        xdaq.dev.profiler.save('profile.json')
+    """
+
+    _pipes = ('WriteToBlockPipeIn', 'ReadFromBlockPipeOut')
+
+    def __init__(self, dev):
+        self.dev = dev
+        self._lock = threading.Lock()
+        # name of the outermost instrumented method running on each thread
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latency = defaultdict(list)
+            self._bytes = Counter()
+            self._invocations = Counter()
+
+    def instrument(self, obj):
+        """
+        Wrap the methods of `obj` so the device calls made while one of them runs are reported
+        under the outermost one running on the calling thread.
+        """
+        for name, attr in vars(type(obj)).items():
+            if inspect.isfunction(attr) and not name.startswith('__'):
+                setattr(obj, name, self._track(name, getattr(obj, name)))
+
+    def _track(self, name: str, method):
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, 'caller', None) is not None:
+                return method(*args, **kwargs)
+            self._local.caller = name
+            with self._lock:
+                self._invocations[name] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._local.caller = None
+
+        return wrapper
+
+    def _caller(self) -> str:
+        return getattr(self._local, 'caller', None) or '<none>'
+
+    def __getattr__(self, name):
+        attr = getattr(self.dev, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            caller = self._caller()
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._latency[caller, name].append(elapsed)
+                    if name in self._pipes:
+                        data = args[2] if len(args) > 2 else kwargs.get('data')
+                        self._bytes[caller, name] += len(data)
+
+        return wrapper
+
+    def report(self) -> dict:
+        """
+        {caller: {'invocations', 'time', 'calls': {method: {'calls', 'total', 'mean', 'p50',
+        'p90', 'p99', 'max', 'bytes'}}}}, latencies in seconds.
+        """
+        with self._lock:
+            latency = {k: np.array(v) for k, v in self._latency.items()}
+            nbytes = dict(self._bytes)
+            invocations = dict(self._invocations)
+        report = {}
+        for (caller, name), t in latency.items():
+            entry = report.setdefault(
+                caller, {
+                    'invocations': invocations.get(caller, 0),
+                    'time': 0.0,
+                    'calls': {}
+                }
+            )
+            entry['time'] += float(t.sum())
+            entry['calls'][name] = {
+                'calls': len(t),
+                'total': float(t.sum()),
+                'mean': float(t.mean()),
+                'p50': float(np.percentile(t, 50)),
+                'p90': float(np.percentile(t, 90)),
+                'p99': float(np.percentile(t, 99)),
+                'max': float(t.max()),
+                'bytes': nbytes.get((caller, name), 0),
+            }
+        return dict(sorted(report.items(), key=lambda kv: -kv[1]['time']))
+
+    def save(self, path: Union[str, Path]):
+        Path(path).write_text(json.dumps(self.report(), indent=4))
+
+    def format(self) -> str:
+        lines = []
+        for caller, entry in self.report().items():
+            lines.append(
+                f"{caller} x{entry['invocations']}: {entry['time'] * 1e3:.2f} ms in device calls"
+            )
+            for name, c in sorted(entry['calls'].items(), key=lambda kv: -kv[1]['total']):
+                lines.append(
+                    f"    {name:<24}{c['calls']:>8} calls {c['total'] * 1e3:10.2f} ms"
+                    f"  p50 {c['p50'] * 1e6:8.1f} us  p99 {c['p99'] * 1e6:8.1f} us"
+                    + (f"  {c['bytes']} bytes" if c['bytes'] else '')
+                )
+        return '\n'.join(lines)
@@ -3,17 +3,19 @@ import time
 from dataclasses import dataclass
 from enum import Enum
 from functools import partial
-from typing import List, Tuple, Union
+from typing import Iterable, List, Sequence, Tuple, Union
 from tqdm.auto import tqdm
 
 import numpy as np
 from dataclass_wizard import JSONWizard
 
 from .board import Board, OkBoard
+from .buffers import BufferPool
 from .constants import *
-from .datablock import DataBlock
+from .datablock import DataBlock, Samples
 from .rhd_driver import RHDDriver
 from .rhs_driver import RHSDriver
+from .stream import BackgroundRun, DataStream
 from . import impedance
 from . import resources
 
@@ -240,6 +242,46 @@ class XDAQPorts(JSONWizard):
             yield self.streams[chip * streams_per_chip:(chip + 1) * streams_per_chip]
 
 
+@dataclass
+class RunWaitStats:
+    """
+    Counters of XDAQ.waitForRunEnd, `latency` is the time between the expected end of a run and
+    the poll which observed it, i.e. the overhead added on top of the acquisition itself.
+    """
+    waits: int = 0
+    polls: int = 0
+    last_polls: int = 0
+    last_latency: float = 0
+    total_latency: float = 0
+
+    @property
+    def polls_per_wait(self) -> float:
+        return self.polls / self.waits if self.waits else 0
+
+
+@dataclass
+class StimConfig:
+    """
+    Compiled stimulation of XDAQ.compileStim: the sequencer register rows and, per group of
+    streams sharing step size and magnitudes, the magnitude and register config command lists.
+    """
+    rows: List[Tuple[int, int, StimRegister, int]]
+    groups: List[Tuple[List[int], np.ndarray, np.ndarray]]
+    readonly: np.ndarray
+    dummy: np.ndarray
+    sample_rate: SampleRate
+
+    @property
+    def key(self) -> tuple:
+        """
+        Identifies the chip registers written by the config.
+        """
+        return tuple(
+            (tuple(streams), magnitude.tobytes(), register.tobytes())
+            for streams, magnitude, register in self.groups
+        )
+
+
 def stim_trigger(source: int, event: TriggerEvent, polarity: TriggerPolarity, enabled: bool):
     return source | event.value << 5 | polarity.value << 6 | enabled << 7
 
@@ -259,12 +301,26 @@ class XDAQ:
     sampleRate: SampleRate = None
     rhs: bool = None
     ep: Union[RHD, RHS, None] = None
+    # drain the FIFO while bounded runs are in progress, see _readWhileRunning
+    readWhileRunning: bool = True
+    readChunkBytes: int = 2**18
 
     def __init__(self, debug: bool = False, dev: Board = None):
         if dev is not None:
             self.dev = dev
         else:
             self.dev = OkBoard(debug)
+        self.buffers = BufferPool()
+        self.run_wait_stats = RunWaitStats()
+        # (aux command slot, bank) -> command words known to be in the aux command RAM
+        self._aux_ram = {}
+        # (stream, channel, StimRegister) -> value known to be in the stimulation sequencer
+        self._stim_regs = {}
+        # StimConfig.key of the chip registers written by the last loadStim
+        self._stim_config = None
+        profiler = getattr(self.dev, 'profiler', None)
+        if profiler is not None:
+            profiler.instrument(self)
 
     def getreg(self, sample_rate: SampleRate) -> Union[RHDDriver, RHSDriver]:
         R = RHSDriver if self.rhs else RHDDriver
@@ -285,8 +341,11 @@ class XDAQ:
         return XDAQMCU.MCU_BUSY
 
     def detect_expander(self):
-        expanderBoardDetected = self.dev.GetWireOutValue(self.ep.ExpanderInfo) != 0
-        expanderBoardIdNumber = (self.dev.GetWireOutValue(self.ep.WireOutSerialDigitalIn) >> 3) & 1
+        with self.wireOutSnapshot():
+            expanderBoardDetected = self.dev.GetWireOutValue(self.ep.ExpanderInfo) != 0
+            expanderBoardIdNumber = (
+                self.dev.GetWireOutValue(self.ep.WireOutSerialDigitalIn) >> 3
+            ) & 1
         return expanderBoardDetected, expanderBoardIdNumber
 
     def config_fpga(self, rhs: bool = False, bitfile: str = None) -> Tuple[int, int]:
@@ -303,9 +362,10 @@ class XDAQ:
         boardId = self.dev.GetWireOutValue(self.ep.WireOutBoardId)
         boardVersion = self.dev.GetWireOutValue(self.ep.WireOutBoardVersion, False)
         self.reset_board()
-        self.expander = self.detect_expander()
+        with self.wireOutSnapshot():
+            self.expander = self.detect_expander()
+            self.xdaqinfo = XDAQInfo.from_board(self.dev)
         self.ports = XDAQPorts.default(2, 1 if rhs else 2, False if rhs else True)
-        self.xdaqinfo = XDAQInfo.from_board(self.dev)
         return boardId, boardVersion
 
     def set32DIO(self, enable: bool):
@@ -317,6 +377,10 @@ class XDAQ:
         This clears all auxiliary command RAM banks, clears the USB FIFO, and resets the
         per-channel sampling rate to 30.0 kS/s/ch.
         """
+        self.dev.invalidate()
+        self._aux_ram.clear()
+        self._stim_regs.clear()
+        self._stim_config = None
         self.dev.SetWireInValue(self.ep.WireInResetRun, 1, 1)
         self.dev.SetWireInValue(self.ep.WireInResetRun, 0, 1)
         # usb3 configuration
@@ -332,14 +396,62 @@ class XDAQ:
     def is_running(self):
         return self.dev.GetWireOutValue(self.ep.WireOutSpiRunning)
 
+    def waitForRunEnd(self, samples: int = None, timeout: float = None):
+        """
+        Wait for the sequencer to stop. Every `is_running` poll is a USB round trip, so for a
+        bounded run of `samples` time steps the expected acquisition time is slept first, then
+        the state is polled with an exponential backoff (0.1 ms doubling up to 10 ms).
+        Poll counts and latency are accumulated in `run_wait_stats`.
+        """
+        start = time.perf_counter()
+        expected = start
+        if samples is not None and self.sampleRate is not None:
+            expected += samples / self.sampleRate.rate
+            time.sleep(max(0, expected - start - 0.0005))
+        polls = 1
+        backoff = 0.0001
+        while self.is_running() > 0:
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError(f'Run did not finish within {timeout} seconds')
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 0.01)
+            polls += 1
+        stats = self.run_wait_stats
+        stats.waits += 1
+        stats.polls += polls
+        stats.last_polls = polls
+        stats.last_latency = max(0, time.perf_counter() - expected)
+        stats.total_latency += stats.last_latency
+
     def numWordsInFifo(self):
         return self.dev.GetWireOutValue(self.ep.WireOutNumWords)
 
+    def wireOutSnapshot(self, max_age: float = 0):
+        """
+        Serve the status reads inside the context (numWordsInFifo, is_running, ...) from a single
+        wire-out update, see OkBoard.wireOutSnapshot.
+
+        Example:
+            with xdaq.wireOutSnapshot():
+                words, running = xdaq.numWordsInFifo(), xdaq.is_running()
+        """
+        return self.dev.wireOutSnapshot(max_age)
+
     def flush(self):
-        self.dev.dev.SetWireInValue(0, 1 << 17)
-        self.dev.dev.UpdateWireIns()
-        self.dev.dev.SetWireInValue(0, 0 << 17)
-        self.dev.dev.UpdateWireIns()
+        self.dev.SetWireInValue(self.ep.WireInResetRun, 1 << 17)
+        self.dev.SetWireInValue(self.ep.WireInResetRun, 0 << 17)
+
+    def batch(self):
+        """
+        Send the wire-in writes of the setters called inside the context in as few USB
+        transactions as possible, see OkBoard.batch.
+
+        Example:
+            with xdaq.batch():
+                for i in range(8):
+                    xdaq.configDac(i, False, 0, 0)
+        """
+        return self.dev.batch()
 
     def selectAuxCommandBank(self, port: Union[int, str], auxCommandSlot, bank: int):
         """
@@ -357,6 +469,7 @@ class XDAQ:
             raise Exception("bank out of range")
         ep = [self.ep.WireInAuxCmdBank1, self.ep.WireInAuxCmdBank2,
               self.ep.WireInAuxCmdBank3][auxCommandSlot]
+        self._stim_config = None
         if isinstance(port, str) and port == 'all':
             # repeat bank for all 8 ports, fill in same 4 bits bank for all ports
             bank = bank << 4 | bank
@@ -378,6 +491,7 @@ class XDAQ:
             raise Exception("loopIndex out of range")
         if endIndex < 0 or endIndex > maxidx:
             raise Exception("endIndex out of range")
+        self._stim_config = None
         if self.rhs:
             self.dev.SendTrig(
                 self.ep.TrigInAuxCmdLength, auxCommandSlot + 4, self.ep.WireInMultiUse, loopIndex
@@ -641,13 +755,21 @@ class XDAQ:
     def enableAuxCommandsOnAllStreams(self):
         if not self.rhs:
             return
+        self._stim_config = None
         self.dev.SetWireInValue(self.ep.WireInAuxEnable, 0xff, 0xff)
 
     def enableAuxCommandsOnOneStream(self, stream):
         if not self.rhs:
             return
+        self._stim_config = None
         self.dev.SetWireInValue(self.ep.WireInAuxEnable, 1 << stream, 0xff)
 
+    def enableAuxCommandsOnStreams(self, streams: Iterable[int]):
+        if not self.rhs:
+            return
+        self._stim_config = None
+        self.dev.SetWireInValue(self.ep.WireInAuxEnable, sum(1 << s for s in set(streams)), 0xff)
+
     def setGlobalSettlePolicy(self, settle: List[bool], global_settle: bool):
         if not self.rhs:
             return
@@ -703,133 +825,198 @@ class XDAQ:
         # 11 EventAmpSettleOnRepeat
         # 12 EventAmpSettleOffRepeat
         # 13 EventEnd
-        self.dev.SetWireInValue(
-            self.ep.WireInStimRegAddr, (stream << 8) | (channel << 4) | reg.value, update=False
-        )
-        self.dev.SetWireInValue(self.ep.WireInStimRegWord, value)
-        self.dev.ActivateTriggerIn(self.ep.TrigInRamAddrReset, 1)
+        self.programStimRegs([(stream, channel, reg, value)])
+
+    def programStimRegs(self, table: Iterable[Tuple[int, int, StimRegister, int]]) -> int:
+        """
+        Program many stimulation sequencer registers at once.
+
+        Parameters
+        ----------
+        table: Iterable[Tuple[int, int, StimRegister, int]]
+            (stream, channel, register, value) rows, a later row for the same register wins.
+
+        Returns
+        -------
+        The number of registers written. Registers already holding the value since the last
+        reset_board are skipped, the others are written in one wire-in batch where each register
+        costs one wire update and one trigger.
+        """
+        rows = {}
+        for stream, channel, reg, value in table:
+            rows[int(stream), int(channel), StimRegister(reg)] = int(value)
+        written = 0
+        with self.batch():
+            for key, value in rows.items():
+                if self._stim_regs.get(key) == value:
+                    continue
+                stream, channel, reg = key
+                self._stim_regs.pop(key, None)
+                self.dev.SetWireInValue(
+                    self.ep.WireInStimRegAddr, (stream << 8) | (channel << 4) | reg.value
+                )
+                self.dev.SetWireInValue(self.ep.WireInStimRegWord, value)
+                self.dev.ActivateTriggerIn(self.ep.TrigInRamAddrReset, 1)
+                self._stim_regs[key] = value
+                written += 1
+        return written
 
     def set_headstage_sequencer(self):
         NEVER = 0xffff
+        table = []
         for stream in range(8):
             for channel in range(16):
-                self.programStimReg(
-                    stream, channel, StimRegister.Trigger,
-                    stim_trigger(0, TriggerEvent.Edge, TriggerPolarity.Low, False)
-                )
-                self.programStimReg(
-                    stream, channel, StimRegister.Param,
-                    stim_params(1, StimShape.Biphasic, StartPolarity.cathodic)
-                )
-                self.programStimReg(stream, channel, StimRegister.EventAmpSettleOn, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventStartStim, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventStimPhase2, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventStimPhase3, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventEndStim, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventRepeatStim, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventAmpSettleOff, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventChargeRecovOn, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventChargeRecovOff, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventAmpSettleOnRepeat, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventAmpSettleOffRepeat, NEVER)
-                self.programStimReg(stream, channel, StimRegister.EventEnd, 65534)
+                table += [
+                    (
+                        stream, channel, StimRegister.Trigger,
+                        stim_trigger(0, TriggerEvent.Edge, TriggerPolarity.Low, False)
+                    ),
+                    (
+                        stream, channel, StimRegister.Param,
+                        stim_params(1, StimShape.Biphasic, StartPolarity.cathodic)
+                    ),
+                    (stream, channel, StimRegister.EventAmpSettleOn, NEVER),
+                    (stream, channel, StimRegister.EventStartStim, NEVER),
+                    (stream, channel, StimRegister.EventStimPhase2, NEVER),
+                    (stream, channel, StimRegister.EventStimPhase3, NEVER),
+                    (stream, channel, StimRegister.EventEndStim, NEVER),
+                    (stream, channel, StimRegister.EventRepeatStim, NEVER),
+                    (stream, channel, StimRegister.EventAmpSettleOff, NEVER),
+                    (stream, channel, StimRegister.EventChargeRecovOn, NEVER),
+                    (stream, channel, StimRegister.EventChargeRecovOff, NEVER),
+                    (stream, channel, StimRegister.EventAmpSettleOnRepeat, NEVER),
+                    (stream, channel, StimRegister.EventAmpSettleOffRepeat, NEVER),
+                    (stream, channel, StimRegister.EventEnd, 65534),
+                ]
 
         for stream in range(8, 16):
-            self.programStimReg(
-                stream, 0, StimRegister.Trigger,
-                stim_trigger(0, TriggerEvent.Edge, TriggerPolarity.Low, False)
-            )
-            self.programStimReg(
-                stream, 0, StimRegister.Param,
-                stim_params(1, StimShape.Monophasic, StartPolarity.cathodic)
-            )
-            self.programStimReg(stream, 0, StimRegister.EventStartStim, 0)
-            self.programStimReg(stream, 0, StimRegister.EventStimPhase2, NEVER)
-            self.programStimReg(stream, 0, StimRegister.EventStimPhase3, NEVER)
-            self.programStimReg(stream, 0, StimRegister.EventEndStim, 200)
-            self.programStimReg(stream, 0, StimRegister.EventRepeatStim, NEVER)
-            self.programStimReg(stream, 0, StimRegister.EventEnd, 240)
-            self.programStimReg(stream, 0, StimRegister.EventChargeRecovOn, 32768)
-            self.programStimReg(stream, 0, StimRegister.EventChargeRecovOff, 32768 + 3200)
-            self.programStimReg(stream, 0, StimRegister.EventAmpSettleOnRepeat, 32768 - 3200)
+            table += [
+                (
+                    stream, 0, StimRegister.Trigger,
+                    stim_trigger(0, TriggerEvent.Edge, TriggerPolarity.Low, False)
+                ),
+                (
+                    stream, 0, StimRegister.Param,
+                    stim_params(1, StimShape.Monophasic, StartPolarity.cathodic)
+                ),
+                (stream, 0, StimRegister.EventStartStim, 0),
+                (stream, 0, StimRegister.EventStimPhase2, NEVER),
+                (stream, 0, StimRegister.EventStimPhase3, NEVER),
+                (stream, 0, StimRegister.EventEndStim, 200),
+                (stream, 0, StimRegister.EventRepeatStim, NEVER),
+                (stream, 0, StimRegister.EventEnd, 240),
+                (stream, 0, StimRegister.EventChargeRecovOn, 32768),
+                (stream, 0, StimRegister.EventChargeRecovOff, 32768 + 3200),
+                (stream, 0, StimRegister.EventAmpSettleOnRepeat, 32768 - 3200),
+            ]
 
         for channel in range(16):
-            self.programStimReg(
-                16, channel, StimRegister.Trigger,
-                stim_trigger(0, TriggerEvent.Edge, TriggerPolarity.Low, False)
-            )
-            self.programStimReg(
-                16, channel, StimRegister.Param,
-                stim_params(3, StimShape.Biphasic, StartPolarity.cathodic)
-            )
-            self.programStimReg(16, channel, StimRegister.EventStartStim, NEVER)
-            self.programStimReg(16, channel, StimRegister.EventEndStim, NEVER)
-            self.programStimReg(16, channel, StimRegister.EventRepeatStim, NEVER)
-            self.programStimReg(16, channel, StimRegister.EventEnd, 65534)
+            table += [
+                (
+                    16, channel, StimRegister.Trigger,
+                    stim_trigger(0, TriggerEvent.Edge, TriggerPolarity.Low, False)
+                ),
+                (
+                    16, channel, StimRegister.Param,
+                    stim_params(3, StimShape.Biphasic, StartPolarity.cathodic)
+                ),
+                (16, channel, StimRegister.EventStartStim, NEVER),
+                (16, channel, StimRegister.EventEndStim, NEVER),
+                (16, channel, StimRegister.EventRepeatStim, NEVER),
+                (16, channel, StimRegister.EventEnd, 65534),
+            ]
+        self.programStimRegs(table)
 
     def initialize(self):
-        self.reset_board()
-        self.enableAuxCommandsOnAllStreams()
-        self.setGlobalSettlePolicy([False, False, False, False], False)
-        self.setSampleRate(SampleRate.SampleRate30000Hz)
-        for auxCommandSlot in range(3):
-            self.selectAuxCommandBank('all', auxCommandSlot, 0)
-        for auxCommandSlot in range(3 + int(self.rhs)):
-            self.selectAuxCommandLength(auxCommandSlot, 0, 0)
-        self.setStimCmdMode(False)
-        self.setContinuousRunMode(True)
-        self.setMaxTimeStep(2**32 - 1)
-        self.setCableDelay('all', self.delayFromCableLength(3.0, 30000, 'ft'))
-
-        self.setDspSettle(False)
-        self.enableDataStream('all', False, True)
-        self.enableDataStream(0, True, True)
-
-        self.enableDcAmpConvert(True)
-        self.setExtraStates(0)
-        self.clearTTLout()
-        for i in range(8):
-            self.configDac(i, False, 0, 0)  # Initially point DACs to DacManual1 input
-        self.setDacManual(32768)
-        self.setDacGain(0)
-        self.setAudioNoiseSuppress(0)
-        self.setTTLMode(False)
-
-        for i in range(8):
-            self.setDacThreshold(i, 32768, True)
-        if not self.rhs:
-            self.enableExternalFastSettle(False)
-            self.setExternalFastSettleChannel(0)
-        for i in range(8):
-            self.enableExternalDigOut(i, False)
-        for i in range(8):
-            self.setExternalDigOutChannel(i, 0)
-        self.config_dac_ref(False)
-        self.enableDacHighpassFilter(False)
-
-        self.setAnalogInTriggerThreshold(1.65)
-        if self.rhs:
-            self.set_headstage_sequencer()
+        with self.batch():
+            self.reset_board()
+            self.enableAuxCommandsOnAllStreams()
+            self.setGlobalSettlePolicy([False, False, False, False], False)
+            self.setSampleRate(SampleRate.SampleRate30000Hz)
+            for auxCommandSlot in range(3):
+                self.selectAuxCommandBank('all', auxCommandSlot, 0)
+            for auxCommandSlot in range(3 + int(self.rhs)):
+                self.selectAuxCommandLength(auxCommandSlot, 0, 0)
+            self.setStimCmdMode(False)
+            self.setContinuousRunMode(True)
+            self.setMaxTimeStep(2**32 - 1)
+            self.setCableDelay('all', self.delayFromCableLength(3.0, 30000, 'ft'))
+
+            self.setDspSettle(False)
+            self.enableDataStream('all', False, True)
+            self.enableDataStream(0, True, True)
+
+            self.enableDcAmpConvert(True)
+            self.setExtraStates(0)
+            self.clearTTLout()
+            for i in range(8):
+                self.configDac(i, False, 0, 0)  # Initially point DACs to DacManual1 input
+            self.setDacManual(32768)
+            self.setDacGain(0)
+            self.setAudioNoiseSuppress(0)
+            self.setTTLMode(False)
+
+            for i in range(8):
+                self.setDacThreshold(i, 32768, True)
+            if not self.rhs:
+                self.enableExternalFastSettle(False)
+                self.setExternalFastSettleChannel(0)
+            for i in range(8):
+                self.enableExternalDigOut(i, False)
+            for i in range(8):
+                self.setExternalDigOutChannel(i, 0)
+            self.config_dac_ref(False)
+            self.enableDacHighpassFilter(False)
+
+            self.setAnalogInTriggerThreshold(1.65)
+            if self.rhs:
+                self.set_headstage_sequencer()
 
     def uploadCommandList(self, commandList: np.ndarray, auxCommandSlot, bank):
+        """
+        Write a command list to the aux command RAM of a slot and bank. The content of the RAM is
+        tracked since the last reset_board: uploads that would not change it are skipped, RHD
+        writes only the words that differ (RHS has a single bank per slot and always rewrites
+        the list from the start).
+        """
         if auxCommandSlot < 0 or auxCommandSlot > (2 + int(self.rhs)):
             raise Exception("auxCommandSlot out of range")
         if bank < 0 or bank > 15:
             raise Exception("bank out of range")
         if self.rhs:
-            self.dev.ActivateTriggerIn(self.ep.TrigInRamAddrReset, 0)
-            ep = [
-                self.ep.PipeInAuxCmd1, self.ep.PipeInAuxCmd2, self.ep.PipeInAuxCmd3,
-                self.ep.PipeInAuxCmd4
-            ][auxCommandSlot]
             commandList = np.pad(commandList, (0, 16 - len(commandList) % 16), 'constant')
-            self.dev.WriteToBlockPipeIn(ep, 16, bytearray(commandList.tobytes(order='C')))
+            key = (auxCommandSlot, 0)
         else:
-            self.dev.SetWireInValue(self.ep.WireInCmdRamBank, bank)
-            for i, cmd in enumerate(commandList):
-                self.dev.SetWireInValue(self.ep.WireInCmdRamData, int(cmd), update=False)
-                self.dev.SetWireInValue(self.ep.WireInCmdRamAddr, i)
-                self.dev.ActivateTriggerIn(self.ep.TrigInConfig, auxCommandSlot + 1)
+            commandList = np.asarray(commandList)
+            key = (auxCommandSlot, bank)
+        known = self._aux_ram.pop(key, np.zeros(0, commandList.dtype))
+        n = min(len(known), len(commandList))
+        changed = np.concatenate(
+            [np.flatnonzero(known[:n] != commandList[:n]),
+             np.arange(n, len(commandList))]
+        )
+        if len(changed) > 0:
+            # the chips may run a different register config from now on
+            self._stim_config = None
+            if self.rhs:
+                self.dev.ActivateTriggerIn(self.ep.TrigInRamAddrReset, 0)
+                ep = [
+                    self.ep.PipeInAuxCmd1, self.ep.PipeInAuxCmd2, self.ep.PipeInAuxCmd3,
+                    self.ep.PipeInAuxCmd4
+                ][auxCommandSlot]
+                self.dev.WriteToBlockPipeIn(ep, 16, bytearray(commandList.tobytes(order='C')))
+            else:
+                # the RHD gateware has no aux command pipe, every word is an addressed write: the
+                # data and address wires go out in one update, followed by the write trigger
+                with self.batch():
+                    self.dev.SetWireInValue(self.ep.WireInCmdRamBank, bank)
+                    for i in changed:
+                        self.dev.SetWireInValue(self.ep.WireInCmdRamData, int(commandList[i]))
+                        self.dev.SetWireInValue(self.ep.WireInCmdRamAddr, int(i))
+                        self.dev.ActivateTriggerIn(self.ep.TrigInConfig, auxCommandSlot + 1)
+        if len(known) > len(commandList):
+            commandList = np.concatenate([commandList, known[len(commandList):]])
+        self._aux_ram[key] = commandList.copy()
 
     def setDacHighpassFilter(self, cutoff: float, smapleRate: float):
         """
@@ -983,7 +1170,8 @@ class XDAQ:
         with self.disablePipeoutThrottle():
             while fifo > 0:
                 tr = min(2**20, ((fifo + 1023) // 1024) * 1024)
-                n = self.readDataToBuffer(bytearray(tr))
+                with self.buffers.borrow(tr) as buffer:
+                    n = self.readDataToBuffer(buffer)
                 fifo -= n
 
     def runAndCleanup(self):
@@ -998,29 +1186,135 @@ class XDAQ:
 
             def __exit__(self, exc_type, exc_value, traceback):
                 self.dev.stop()
-                while self.dev.is_running() > 0:
-                    time.sleep(0.01)
+                self.dev.waitForRunEnd()
                 self.dev.discardFIFO()
 
         return Context(self)
 
-    def readBuffer(self, samples) -> Tuple[int, bytearray]:
-        bs = self.getSampleSizeBytes() * samples
-        buffer = bytearray(max(((bs + 1023) // 1024) * 1024, 1024))
-        return self.readDataToBuffer(buffer), buffer
+    def stream(
+        self,
+        chunk_samples: int = 128 * 64,
+        buffers: int = 16,
+        timeout: Union[float, None] = None
+    ) -> DataStream:
+        """
+        Continuous acquisition in the background, decoded DataBlocks are read by iterating over
+        the returned stream. See DataStream for details.
+
+        Parameters
+        ----------
+        chunk_samples : int
+            Number of samples per USB read and per yielded block, multiple of 128.
+        buffers : int
+            Number of preallocated read buffers, bounds the memory used by the stream.
+        timeout : float
+            Seconds to wait for a block, defaults to the time to fill one chunk plus 5 seconds.
+        """
+        return DataStream(self, chunk_samples, buffers, timeout)
+
+    def runInBackground(
+        self,
+        samples: int,
+        chunk_samples: int = 128 * 64,
+        callback=None,
+        decimate: int = 1
+    ) -> BackgroundRun:
+        """
+        Bounded run of `samples` time steps which does not block the caller, progress and early
+        cancel are exposed by the returned handle. See BackgroundRun for details.
+
+        Parameters
+        ----------
+        samples : int
+            Number of time steps to run.
+        chunk_samples : int
+            Largest number of samples per USB read, multiple of 128.
+        callback : Callable[[DataBlock], None]
+            Optional, receives the samples read back decimated by `decimate`.
+        decimate : int
+            Keep the samples whose timestamp is a multiple of `decimate`.
+        """
+        return BackgroundRun(self, samples, chunk_samples, callback, decimate)
+
+    def readBuffer(self, samples, out: bytearray = None) -> Tuple[int, bytearray]:
+        """
+        Read `samples` samples from the FIFO. The read size is rounded up to the 1024 bytes pipe
+        block size, `out` can be a caller-provided buffer of exactly that size (e.g. from
+        `self.buffers`) to avoid allocating a new one.
+        """
+        out = self._readBufferFor(samples, out)
+        return self.readDataToBuffer(out), out
+
+    def _readBufferFor(self, samples, out: bytearray = None) -> bytearray:
+        size = BufferPool.size_class(self.getSampleSizeBytes() * samples)
+        if out is None:
+            return bytearray(size)
+        if len(out) != size:
+            raise ValueError(f'Buffer size {len(out)} does not match the read size {size}')
+        return out
 
-    def runAndReadBuffer(self, samples, discard=False) -> Tuple[int, bytearray, None]:
+    def _readWhileRunning(self, samples, out: bytearray = None) -> Tuple[int, bytearray]:
+        """
+        Read the data of a bounded run of `samples` time steps while the sequencer is still
+        running, so the USB transfer overlaps the acquisition. The FIFO word count sizes each
+        read, up to `readChunkBytes` even when the FIFO holds more; reads are power-of-two
+        multiples of the pipe block size so the scratch buffers come from a handful of pool size
+        classes.
+        """
+        out = self._readBufferFor(samples, out)
+        size = len(out)
+        view = memoryview(out)
+        bytes_per_second = self.getSampleSizeBytes() * self.sampleRate.rate
+        expected_end = time.perf_counter() + samples / self.sampleRate.rate
+        got = 0
+        while got < size:
+            remaining = size - got
+            target = min(remaining, self.readChunkBytes)
+            with self.wireOutSnapshot():
+                available = (self.numWordsInFifo() * 2) // 1024 * 1024
+                running = time.perf_counter() < expected_end or self.is_running() > 0
+            if available < target:
+                if running:
+                    time.sleep(max((target - available) / bytes_per_second, 0.0001))
+                    continue
+                # the run is over, read the rest like readBuffer does
+                available = remaining
+            n = BufferPool.chunk_size(min(available, remaining, self.readChunkBytes))
+            if n == size:
+                return self.readDataToBuffer(out), out
+            with self.buffers.borrow(n) as scratch:
+                n = self.readDataToBuffer(scratch)
+                view[got:got + n] = memoryview(scratch)[:n]
+            got += n
+        return got, out
+
+    def runAndReadBuffer(self,
+                         samples,
+                         discard=False,
+                         out: bytearray = None) -> Union[Tuple[int, bytearray], None]:
         self.resetSequencers()
         self.setMaxTimeStep(samples)
         self.setContinuousRunMode(False)
         self.run()
-        while self.is_running() > 0:
-            time.sleep(0.001)
+        if not discard and self.readWhileRunning and self.sampleRate is not None:
+            return self._readWhileRunning(samples, out)
+        self.waitForRunEnd(samples)
         if discard:
             self.discardFIFO()
             return None
         else:
-            return self.readBuffer(samples)
+            return self.readBuffer(samples, out)
+
+    def runAndReadSamples(self, samples: int) -> Samples:
+        """
+        Same as `runAndReadDataBlock(samples).to_samples()`, but the raw data is read into a
+        pooled buffer which is recycled once the samples are copied out.
+        """
+        with self.buffers.borrow(self.getSampleSizeBytes() * samples) as buffer:
+            n, buffer = self.runAndReadBuffer(samples, out=buffer)
+            return DataBlock.from_buffer(
+                self.rhs, self.getSampleSizeBytes(), buffer, self.numDataStream, self.mode32DIO
+            ).to_samples()
 
     def readDataBlock(self, samples) -> DataBlock:
         n, buffer = self.readBuffer(samples)
@@ -1060,7 +1354,7 @@ class XDAQ:
         results = []
         for delay in range(16):
             self.setCableDelay('all', delay)
-            sp = self.runAndReadDataBlock(128).to_samples()
+            sp = self.runAndReadSamples(128)
             nameok = (sp.device_name().T.astype(np.uint8) == headstagename).all(axis=1)
             ids, miso = sp.device_id()
             results.append(
@@ -1148,14 +1442,40 @@ class XDAQ:
         trigger_source: int, trigger_pol: TriggerPolarity, step_size: StimStepSize, enable: bool,
         post_charge_recovery_ms: float
     ):
-        dt = 1 / self.sampleRate.value[2]
-        self.programStimReg(
-            stream, channel, StimRegister.Trigger,
-            stim_trigger(trigger_source, trigger, trigger_pol, enable)
-        )
-        self.programStimReg(
-            stream, channel, StimRegister.Param, stim_params(pulses, shape, polarity)
+        self.set_stim_many(
+            [
+                dict(
+                    stream=stream,
+                    channel=channel,
+                    polarity=polarity,
+                    shape=shape,
+                    delay_ms=delay_ms,
+                    duration_phase1_ms=duration_phase1_ms,
+                    duration_phase2_ms=duration_phase2_ms,
+                    duration_phase3_ms=duration_phase3_ms,
+                    amp_neg_mA=amp_neg_mA,
+                    amp_pos_mA=amp_pos_mA,
+                    pulses=pulses,
+                    duration_pulse_ms=duration_pulse_ms,
+                    pre_ampsettle_ms=pre_ampsettle_ms,
+                    post_ampsettle_ms=post_ampsettle_ms,
+                    trigger=trigger,
+                    trigger_source=trigger_source,
+                    trigger_pol=trigger_pol,
+                    step_size=step_size,
+                    post_charge_recovery_ms=post_charge_recovery_ms,
+                )
+            ], enable
         )
+
+    def _stim_rows(
+        self, stream: int, channel: int, polarity: StartPolarity, shape: StimShape, delay_ms: float,
+        duration_phase1_ms: float, duration_phase2_ms: float, duration_phase3_ms: float,
+        pulses: int, duration_pulse_ms: float, pre_ampsettle_ms: float, post_ampsettle_ms: float,
+        trigger: TriggerEvent, trigger_source: int, trigger_pol: TriggerPolarity, enable: bool,
+        post_charge_recovery_ms: float, **_
+    ) -> List[Tuple[int, int, StimRegister, int]]:
+        dt = 1 / self.sampleRate.value[2]
         t0 = int(delay_ms * 1e-3 / dt)
         t1 = int(duration_phase1_ms * 1e-3 / dt) + t0
         t2 = int(duration_phase2_ms * 1e-3 / dt) + t1
@@ -1177,52 +1497,169 @@ class XDAQ:
             t_charge_recovery_on = 0xFFFF
             t_charge_recovery_off = 0xFFFF
 
-        self.programStimReg(stream, channel, StimRegister.EventAmpSettleOn, t_ampsettle_on)
-        self.programStimReg(stream, channel, StimRegister.EventStartStim, t0)
-        self.programStimReg(stream, channel, StimRegister.EventStimPhase2, t1)
-        self.programStimReg(stream, channel, StimRegister.EventStimPhase3, t2)
-        self.programStimReg(stream, channel, StimRegister.EventEndStim, t3)
-        self.programStimReg(stream, channel, StimRegister.EventRepeatStim, t4)
-        self.programStimReg(stream, channel, StimRegister.EventAmpSettleOff, t_ampsettle_off)
-        self.programStimReg(stream, channel, StimRegister.EventChargeRecovOn, t_charge_recovery_on)
-        self.programStimReg(
-            stream, channel, StimRegister.EventChargeRecovOff, t_charge_recovery_off
-        )
-        self.programStimReg(stream, channel, StimRegister.EventAmpSettleOnRepeat, 0xFFFF)
-        self.programStimReg(stream, channel, StimRegister.EventAmpSettleOffRepeat, 0xFFFF)
-        self.programStimReg(stream, channel, StimRegister.EventEnd, t4)
-        self.enableAuxCommandsOnOneStream(stream)
+        return [
+            (
+                stream, channel, StimRegister.Trigger,
+                stim_trigger(trigger_source, trigger, trigger_pol, enable)
+            ),
+            (stream, channel, StimRegister.Param, stim_params(pulses, shape, polarity)),
+            (stream, channel, StimRegister.EventAmpSettleOn, t_ampsettle_on),
+            (stream, channel, StimRegister.EventStartStim, t0),
+            (stream, channel, StimRegister.EventStimPhase2, t1),
+            (stream, channel, StimRegister.EventStimPhase3, t2),
+            (stream, channel, StimRegister.EventEndStim, t3),
+            (stream, channel, StimRegister.EventRepeatStim, t4),
+            (stream, channel, StimRegister.EventAmpSettleOff, t_ampsettle_off),
+            (stream, channel, StimRegister.EventChargeRecovOn, t_charge_recovery_on),
+            (stream, channel, StimRegister.EventChargeRecovOff, t_charge_recovery_off),
+            (stream, channel, StimRegister.EventAmpSettleOnRepeat, 0xFFFF),
+            (stream, channel, StimRegister.EventAmpSettleOffRepeat, 0xFFFF),
+            (stream, channel, StimRegister.EventEnd, t4),
+        ]
+
+    def set_stim_many(self, stims: Sequence[dict], enable: bool):
+        """
+        Configure the stimulation of many channels with one set of sequencer runs.
+
+        Parameters
+        ----------
+        stims: Sequence[dict]
+            The keyword arguments of set_stim, except enable, one dict per channel. A later entry
+            for the same (stream, channel) wins.
+        enable: bool
+            Enable or disable the stimulation of every channel.
+
+        The timing registers of all channels are programmed in one table. The current magnitudes
+        and step size are chip registers, streams sharing the same settings are written together:
+        one magnitude run per distinct setting, one shared readback run and one register config
+        run per distinct setting, three runs when all streams agree.
+        """
+        self.loadStim(self.compileStim(stims, enable))
+
+    def compileStim(self, stims: Sequence[dict], enable: bool) -> StimConfig:
+        """
+        Build the registers and command lists of set_stim_many without touching the device, the
+        result can be loaded any number of times with loadStim.
+        """
+        stims = list({(s['stream'], s['channel']): s for s in stims}.values())
+        rows = [row for stim in stims for row in self._stim_rows(**stim, enable=enable)]
+
+        chips = {}
+        for stim in stims:
+            step_size = stim['step_size']
+            chip = chips.setdefault(stim['stream'], (step_size, {}))
+            if chip[0] != step_size:
+                raise ValueError(
+                    f'Stream {stim["stream"]} has different step sizes, '
+                    'the step size is shared by all channels of a chip'
+                )
+            chip[1][stim['channel']] = tuple(
+                int(min(255, round(amp * 1e6 / step_size.nA))) if enable else 0
+                for amp in (stim['amp_neg_mA'], stim['amp_pos_mA'])
+            )
+        groups = {}
+        for stream, (step_size, magnitudes) in sorted(chips.items()):
+            key = (step_size, tuple(sorted(magnitudes.items())))
+            groups.setdefault(key, []).append(stream)
+
         reg = self.getreg(self.sampleRate)
-        reg.setStimStepSize(step_size)
-        cmd = reg.createCommandListSetStimMagnitudes(
-            magnitude_neg=int(min(255, round(amp_neg_mA * 1e6 / step_size.nA))) if enable else 0,
-            magnitude_pos=int(min(255, round(amp_pos_mA * 1e6 / step_size.nA))) if enable else 0,
-            channel=channel
+        config = StimConfig(
+            rows=rows,
+            groups=[],
+            readonly=reg.createCommandListRegisterConfig(update_stim=True, readonly=True),
+            dummy=reg.dummy(8192),
+            sample_rate=self.sampleRate,
         )
-        self.uploadCommandList(cmd, 0, 0)
-        self.selectAuxCommandLength(0, 0, len(cmd) - 1)
-
-        cmd = reg.dummy(8192)
-        for aux in [1, 2, 3]:
-            self.uploadCommandList(cmd, aux, 0)
-        self.setStimCmdMode(False)
-        self.enableAuxCommandsOnOneStream(stream)
-        self.runAndReadBuffer(samples=128, discard=True)
+        for (step_size, magnitudes), streams in groups.items():
+            reg = self.getreg(self.sampleRate)
+            reg.setStimStepSize(step_size)
+            magnitude = reg.createCommandListSetStimMagnitudes(
+                magnitude_neg=np.array([m[0] for _, m in magnitudes]),
+                magnitude_pos=np.array([m[1] for _, m in magnitudes]),
+                channel=[c for c, _ in magnitudes]
+            )
+            reg.set_upper_bandwidth(7500)
+            reg.set_lower_bandwidth_a(1000)
+            reg.set_lower_bandwidth_b(1)
+            register = reg.createCommandListRegisterConfig(update_stim=True, readonly=False)
+            config.groups.append((streams, magnitude, register))
+        return config
 
-        reg.set_upper_bandwidth(7500)
-        reg.set_lower_bandwidth_a(1000)
-        reg.set_lower_bandwidth_b(1)
+    def loadStim(self, config: StimConfig):
+        """
+        Program a compiled stimulation config. The chip registers are only rewritten when they
+        may differ from the config last loaded: after reset_board, an aux command upload to any
+        slot or a change of the aux command lengths, banks or enabled streams. Otherwise loading
+        a config already in place costs the changed sequencer registers only.
+        """
+        if config.sample_rate != self.sampleRate:
+            raise ValueError(
+                f'Stimulation compiled for {config.sample_rate}, the board runs at '
+                f'{self.sampleRate}'
+            )
+        self.programStimRegs(config.rows)
+        if not config.groups or self._stim_config == config.key:
+            return
 
-        cmd = reg.createCommandListRegisterConfig(update_stim=True, readonly=True)
-        self.uploadCommandList(cmd, 0, 0)
-        self.selectAuxCommandLength(0, 0, len(cmd) - 1)
+        for i, (streams, magnitude, _) in enumerate(config.groups):
+            self.uploadCommandList(magnitude, 0, 0)
+            self.selectAuxCommandLength(0, 0, len(magnitude) - 1)
+            if i == 0:
+                for aux in [1, 2, 3]:
+                    self.uploadCommandList(config.dummy, aux, 0)
+                self.setStimCmdMode(False)
+            self.enableAuxCommandsOnStreams(streams)
+            self.runAndReadBuffer(samples=128, discard=True)
+
+        self.uploadCommandList(config.readonly, 0, 0)
+        self.selectAuxCommandLength(0, 0, len(config.readonly) - 1)
+        self.enableAuxCommandsOnStreams(s for streams, _, _ in config.groups for s in streams)
         self.runAndReadBuffer(samples=128, discard=True)
 
-        cmd = reg.createCommandListRegisterConfig(update_stim=True, readonly=False)
-        self.uploadCommandList(cmd, 0, 0)
-        self.selectAuxCommandLength(0, 0, len(cmd) - 1)
-        self.enableAuxCommandsOnAllStreams()
-        self.runAndReadBuffer(samples=128, discard=True)
+        for streams, _, register in config.groups:
+            self.uploadCommandList(register, 0, 0)
+            self.selectAuxCommandLength(0, 0, len(register) - 1)
+            if len(config.groups) == 1:
+                self.enableAuxCommandsOnAllStreams()
+            else:
+                self.enableAuxCommandsOnStreams(streams)
+            self.runAndReadBuffer(samples=128, discard=True)
+        if len(config.groups) > 1:
+            # looping one group's config on every stream would overwrite the others
+            self.uploadCommandList(config.readonly, 0, 0)
+            self.selectAuxCommandLength(0, 0, len(config.readonly) - 1)
+            self.enableAuxCommandsOnAllStreams()
+        self._stim_config = config.key
+
+    def _setupImpedance(self) -> Union[RHDDriver, RHSDriver]:
+        """
+        Disable the outputs and select the zcheck register config in aux slot 2 bank 3, returns
+        the driver holding the zcheck settings shared by the impedance measurements.
+        """
+        with self.batch():
+            self.setStimCmdMode(False)
+            for i in range(8):
+                self.enableExternalDigOut(i, False)
+            for i in range(8):
+                self.enableDac(i, False)
+
+        reg = self.getreg(self.sampleRate)
+        reg.set_dsp_cutoff_freq(0.5)
+        if self.rhs:
+            reg.set_lower_bandwidth_b(1)
+        else:
+            reg.set_lower_bandwidth(1)
+        reg.set_upper_bandwidth(7500)
+        reg.controller.set('dspEnable', 1)
+        reg.controller.set('zcheckEn', 1)
+        if self.rhs:
+            cmd = reg.createCommandListRegisterConfig(False, False)
+        else:
+            cmd = reg.createCommandListRegisterConfig(False)
+        # self.uploadCommandList(cmd, 2, 3)
+        self.selectAuxCommandLength(2, 0, len(cmd) - 1)
+        self.selectAuxCommandBank('all', 2, 3)
+        return reg
 
     def measure_impedance(
         self,
@@ -1262,40 +1699,19 @@ class XDAQ:
         When raw_data_return is True:
         raw_data: np.ndarray
         """
-        self.setStimCmdMode(False)
-        for i in range(8):
-            self.enableExternalDigOut(i, False)
-        for i in range(8):
-            self.enableDac(i, False)
-
+        reg = self._setupImpedance()
         headstage_channels = 16 if self.rhs else 32
         test_channels = channels if channels is not None else list(range(headstage_channels))
         sample_rate = self.sampleRate.rate
         period = frequency.get_period(sample_rate)
         frequency = frequency.get_actual(sample_rate)
 
-        reg = self.getreg(self.sampleRate)
         cmd = reg.createCommandListZcheckDac(frequency, 128)
         self.uploadCommandList(cmd, 0, 1)
         self.selectAuxCommandLength(0, 0, len(cmd) - 1)
         self.selectAuxCommandBank('all', 0, 1)
         num_periods = strategy.get_num_periods(frequency)
         numBlocks = int(np.ceil((num_periods + 2) * period / 128))
-        reg.set_dsp_cutoff_freq(0.5)
-        if self.rhs:
-            reg.set_lower_bandwidth_b(1)
-        else:
-            reg.set_lower_bandwidth(1)
-        reg.set_upper_bandwidth(7500)
-        reg.controller.set('dspEnable', 1)
-        reg.controller.set('zcheckEn', 1)
-        if self.rhs:
-            cmd = reg.createCommandListRegisterConfig(False, False)
-        else:
-            cmd = reg.createCommandListRegisterConfig(False)
-        # self.uploadCommandList(cmd, 2, 3)
-        self.selectAuxCommandLength(2, 0, len(cmd) - 1)
-        self.selectAuxCommandBank('all', 2, 3)
 
         all_data = []
         for zscale in tqdm(range(3), disable=not progress, desc='scale'):
@@ -1308,8 +1724,8 @@ class XDAQ:
                 else:
                     cmd = reg.createCommandListRegisterConfig(False)
                 self.uploadCommandList(cmd, 2, 3)
-                self.runAndReadDataBlock(samples=128)  # apply the new command
-                sps = self.runAndReadDataBlock(samples=numBlocks * 128).to_samples()
+                self.runAndReadSamples(samples=128)  # apply the new command
+                sps = self.runAndReadSamples(samples=numBlocks * 128)
                 if self.rhs:
                     data = sps.amp[:, :, :, 1]
                 else:
@@ -1344,6 +1760,107 @@ class XDAQ:
 
         return magnitude.reshape((n_stream, n_test_ch)), phase.reshape((n_stream, n_test_ch))
 
+    def measure_impedance_sweep(
+        self,
+        frequencies: Union[Sequence[float], np.ndarray],
+        strategy: impedance.Strategy = impedance.Strategy.auto(),
+        channels: List[int] = None,
+        progress: bool = True,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Measure impedance of the headstage at many frequencies, see measure_impedance.
+
+        The register config selecting the tested channel and scale is applied once per channel
+        and scale, then every frequency is acquired by switching the zcheck DAC waveform only.
+        RHD keeps up to 15 waveforms in banks 1-15 of aux slot 0 and switches between them with
+        a wire update, a waveform is only uploaded when the bank holds something else (e.g. not
+        on a repeated sweep). RHS has a single bank and re-uploads the waveform on each switch.
+
+        Parameters:
+        -----------
+        frequencies: Union[Sequence[float], np.ndarray]
+            Target frequencies in Hz, each is adjusted like impedance.Frequency.get_actual, the
+            actual frequencies are `impedance.Frequency(frequencies).get_actual(sample_rate)`.
+            Frequencies sharing the same actual frequency are measured once.
+        strategy: impedance.Strategy
+            Specify the measurement duration, see Strategy for details.
+        channels: List[int]
+            The channels to test, if None, test all channels.
+            Note that all datastreams will be tested in parallel.
+        progress: bool
+            Whether to show progress bar
+
+        Returns:
+        --------
+        magnitude: np.ndarray
+            The magnitude of the impedance in Ohm, shape (n_frequency, n_stream, n_channel)
+        phase: np.ndarray
+            The phase of the impedance in degree, shape (n_frequency, n_stream, n_channel)
+        """
+        sample_rate = self.sampleRate.rate
+        targets = impedance.Frequency(np.atleast_1d(np.asarray(frequencies, dtype=float)))
+        targets.get_actual(sample_rate)  # warn about the frequencies far from their target
+        periods = targets.get_period(sample_rate).tolist()
+        unique = list(dict.fromkeys(periods))
+
+        reg = self._setupImpedance()
+        headstage_channels = 16 if self.rhs else 32
+        test_channels = channels if channels is not None else list(range(headstage_channels))
+        banks = len(unique) if self.rhs else 15
+        # period -> zscale -> test channel -> (stream, signal)
+        signals = {period: [[], [], []] for period in unique}
+        bar = tqdm(
+            total=len(unique) * 3 * len(test_channels), disable=not progress, desc='measurement'
+        )
+        for start in range(0, len(unique), banks):
+            group = unique[start:start + banks]
+            waves = [reg.createCommandListZcheckDac(sample_rate / p, 128) for p in group]
+            if not self.rhs:
+                for bank, cmd in enumerate(waves, 1):
+                    self.uploadCommandList(cmd, 0, bank)
+            for zscale in range(3):
+                reg.controller.set('zcheckScale', zscale)
+                for ch in test_channels:
+                    reg.controller.set('zcheckSelect', ch)
+                    if self.rhs:
+                        cmd = reg.createCommandListRegisterConfig(False, False)
+                    else:
+                        cmd = reg.createCommandListRegisterConfig(False)
+                    self.uploadCommandList(cmd, 2, 3)
+                    self.runAndReadSamples(samples=128)  # apply the new command
+                    for bank, (period, cmd) in enumerate(zip(group, waves), 1):
+                        if self.rhs:
+                            self.uploadCommandList(cmd, 0, 0)
+                        self.selectAuxCommandLength(0, 0, len(cmd) - 1)
+                        self.selectAuxCommandBank('all', 0, bank)
+                        num_periods = strategy.get_num_periods(sample_rate / period)
+                        numBlocks = int(np.ceil((num_periods + 2) * period / 128))
+                        sps = self.runAndReadSamples(samples=numBlocks * 128)
+                        # (signal, channel, stream) -> stream, signal
+                        data = (sps.amp[:, :, :, 1] if self.rhs else sps.amp)[:, ch, :].T
+                        data = data[:, :period * num_periods][:, 3 + 2 * period:3 - period]
+                        signals[period][zscale].append(data)
+                        bar.update()
+        bar.close()
+
+        results = {}
+        for period, data in signals.items():
+            # zscale, target_channel, stream, signal -> zscale, stream * target_channel, signal
+            data = np.moveaxis(np.array(data), 1, 2)
+            n_zscale, n_stream, n_test_ch, _ = data.shape
+            magnitude, phase = impedance.calculate_impedance(
+                data.reshape((n_zscale, n_stream * n_test_ch, -1)),
+                sample_rate,
+                rhs=self.rhs,
+                frequency=sample_rate / period,
+            )
+            results[period] = (
+                magnitude.reshape((n_stream, n_test_ch)), phase.reshape((n_stream, n_test_ch))
+            )
+        return (
+            np.stack([results[p][0] for p in periods]), np.stack([results[p][1] for p in periods])
+        )
+
 
 def get_XDAQ(
     *,
@@ -1351,9 +1868,10 @@ def get_XDAQ(
     bitfile: str = None,
     fastSettle: bool = False,
     skip_headstage: bool = False,
-    debug: bool = False
+    debug: bool = False,
+    dev: Board = None
 ):
-    xdaq = XDAQ(debug=debug)
+    xdaq = XDAQ(debug=debug, dev=dev)
     for retry in range(2):
         try:
             xdaq.config_fpga(rhs, bitfile)
@@ -0,0 +1,301 @@
+"""
+Benchmark the acquisition hot paths against the simulated board and save the results as JSON,
+compare the files of two versions to spot regressions.
+
+    python scripts/benchmark.py --output benchmark.json
+
+By default bounded runs complete instantly (SimulatedBoard(realtime=False)) so the latencies
+are the host side cost plus the frame generation of the simulator, use --realtime to include the
+acquisition time. from_buffer and to_samples(copy=False) are zero copy, their MB/s is the rate at
+which buffers are wrapped rather than bytes touched.
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from pyxdaq import impedance
+from pyxdaq.constants import StartPolarity, StimShape, StimStepSize, TriggerEvent, TriggerPolarity
+from pyxdaq.datablock import _header_magic, DataBlock, sample_dtype
+from pyxdaq.simulator import SimulatedBoard
+from pyxdaq.utils import git_version_diff
+from pyxdaq.xdaq import get_XDAQ
+
+
+def latency(fn, repeat: int, setup=None) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {
+        'n': repeat,
+        'mean': float(times.mean()),
+        'p50': float(np.percentile(times, 50)),
+        'p90': float(np.percentile(times, 90)),
+        'max': float(times.max()),
+    }
+
+
+def peak_memory(fn) -> int:
+    """
+    Python and numpy allocation high-water mark of one call, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def frames(rhs: bool, datastreams: int, mode32DIO: bool, samples: int) -> bytearray:
+    dtype = sample_dtype(rhs, datastreams, mode32DIO)
+    data = np.zeros(samples, dtype)
+    data['magic'] = _header_magic(rhs)
+    data['ts'] = np.arange(samples)
+    data['amp'] = np.random.default_rng(0).integers(0, 65536, data['amp'].shape)
+    return bytearray(data.tobytes())
+
+
+def bench_decode(samples: int, repeat: int) -> list:
+    results = []
+    layouts = [(False, ds, False) for ds in [1, 8, 32]] + [(False, 8, True)]
+    layouts += [(True, ds, False) for ds in [1, 4, 8]]
+    for rhs, datastreams, mode32DIO in layouts:
+        buffer = frames(rhs, datastreams, mode32DIO, samples)
+        sample_size = len(buffer) // samples
+        decode = lambda: DataBlock.from_buffer(rhs, sample_size, buffer, datastreams, mode32DIO)
+        block = decode()
+        for name, fn in [
+            ('from_buffer', decode),
+            ('to_samples', block.to_samples),
+            ('to_samples_view', lambda: block.to_samples(copy=False)),
+        ]:
+            stats = latency(fn, repeat)
+            results.append(
+                {
+                    'op': name,
+                    'rhs': rhs,
+                    'datastreams': datastreams,
+                    'mode32DIO': mode32DIO,
+                    'samples': samples,
+                    'MBps': len(buffer) / stats['p50'] / 1e6,
+                    'samples_per_s': samples / stats['p50'],
+                    'latency': stats,
+                    'peak_memory': peak_memory(fn),
+                }
+            )
+    return results
+
+
+def stim_kwargs(enable: bool) -> dict:
+    return dict(
+        stream=0,
+        channel=0,
+        polarity=StartPolarity.cathodic,
+        shape=StimShape.Biphasic,
+        delay_ms=0,
+        duration_phase1_ms=0.1,
+        duration_phase2_ms=0.1,
+        duration_phase3_ms=0,
+        amp_neg_mA=0.01,
+        amp_pos_mA=0.01,
+        pulses=1,
+        duration_pulse_ms=1,
+        pre_ampsettle_ms=0,
+        post_ampsettle_ms=0,
+        trigger=TriggerEvent.Edge,
+        trigger_source=24,
+        trigger_pol=TriggerPolarity.High,
+        step_size=StimStepSize.StimStepSize1uA,
+        enable=enable,
+        post_charge_recovery_ms=0,
+    )
+
+
+def bench_device(rhs: bool, realtime: bool, repeat: int) -> dict:
+    board = lambda: SimulatedBoard(realtime=realtime)
+    startup = lambda: get_XDAQ(rhs=rhs, dev=board())
+    xdaq = startup()
+    zcheck = lambda: xdaq.measure_impedance(
+        impedance.Frequency(1000.0), channels=[0, 1], progress=False
+    )
+    calls = {
+        'get_XDAQ': (startup, max(1, repeat // 4), None),
+        'runAndReadBuffer_128': (lambda: xdaq.runAndReadBuffer(128), repeat, None),
+        'runAndReadBuffer_12800': (lambda: xdaq.runAndReadBuffer(128 * 100), repeat, None),
+        'measure_impedance': (zcheck, max(1, repeat // 4), None),
+    }
+    if rhs:
+        # loadStim skips the sequencer runs when the chips already hold the config, the uncached
+        # calls alternate between two magnitudes and the cached call is timed on its own
+        configs = []
+        for amp in [0.01, 0.02]:
+            stim = dict(stim_kwargs(True), amp_neg_mA=amp)
+            stims = [dict(stim, channel=c) for c in range(16)]
+            for s in stims:
+                del s['enable']
+            configs.append((stim, stims))
+        configs = itertools.cycle(configs)
+        current = list(next(configs))
+
+        def alternate():
+            current[:] = next(configs)
+
+        set_stim = lambda: xdaq.set_stim(**current[0])
+        set_stim_many = lambda: xdaq.set_stim_many(current[1], True)
+        calls['set_stim'] = (set_stim, repeat, alternate)
+        calls['set_stim_cached'] = (set_stim, repeat, None)
+        calls['set_stim_many_16'] = (set_stim_many, repeat, alternate)
+        calls['set_stim_many_16_cached'] = (set_stim_many, repeat, None)
+    results = {}
+    for name, (fn, n, setup) in calls.items():
+        stats = latency(fn, n, setup)
+        if setup is not None:
+            setup()
+        results[name] = {'latency': stats, 'peak_memory': peak_memory(fn)}
+    return results
+
+
+def transactions(profiler) -> int:
+    """
+    USB transactions recorded by a ProfilingWrapper, SetWireInValue and GetWireOutValue only
+    touch the host side buffers.
+    """
+    return sum(
+        c['calls']
+        for entry in profiler.report().values()
+        for name, c in entry['calls'].items()
+        if name not in ('SetWireInValue', 'GetWireOutValue')
+    )
+
+
+def bench_uploads(repeat: int) -> dict:
+    """
+    RHD aux command RAM uploads, cold after reset_board (every word is written, as every upload
+    did before the RAM content was tracked) and warm (the content is known and only changes are
+    sent). The difference between the two is the saving of the RAM tracking; batching the
+    upload into a wire-in transaction only saves the separate bank select update, i.e. one
+    transaction per upload in both states.
+    """
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False, profile=True))
+    profiler = xdaq.dev.profiler
+    reg = xdaq.getreg(xdaq.sampleRate)
+    zcheck = reg.createCommandListZcheckDac(1000.0, 128)
+    config = reg.createCommandListRegisterConfig(False)
+    reg.controller.set('zcheckSelect', 1)
+    config_next = reg.createCommandListRegisterConfig(False)
+    calls = {
+        'uploadCommands':
+            lambda: xdaq.uploadCommands(),
+        'zcheck_dac':
+            lambda: xdaq.uploadCommandList(zcheck, 0, 1),
+        'zcheck_channel_step':
+            lambda:
+            (xdaq.uploadCommandList(config, 2, 3), xdaq.uploadCommandList(config_next, 2, 3)),
+    }
+    results = {}
+    for name, fn in calls.items():
+        for state, setup in [('cold', xdaq.reset_board), ('warm', None)]:
+            stats = latency(fn, repeat, setup)
+            if setup is not None:
+                setup()
+            profiler.reset()
+            fn()
+            results[f'{name}_{state}'] = {'latency': stats, 'transactions': transactions(profiler)}
+    return results
+
+
+def profile_device(rhs: bool, realtime: bool) -> dict:
+    """
+    Device calls made by one get_XDAQ and one impedance measurement, per XDAQ method.
+    """
+    xdaq = get_XDAQ(rhs=rhs, dev=SimulatedBoard(realtime=realtime, profile=True))
+    xdaq.measure_impedance(impedance.Frequency(1000.0), channels=[0, 1], progress=False)
+    return xdaq.dev.profiler.report()
+
+
+def max_rss():
+    """
+    Peak resident set size of the process in bytes, None where it is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def version():
+    try:
+        return git_version_diff()[0]
+    except RuntimeError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--output', type=Path, default=Path('benchmark.json'))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--samples', type=int, default=128 * 256, help='samples per decoded block')
+    parser.add_argument('--realtime', action='store_true')
+    parser.add_argument('--quick', action='store_true', help='few repeats, for smoke testing')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.repeat, args.samples = 2, 128 * 4
+
+    report = {
+        'version': version(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'realtime': args.realtime,
+        'decode': bench_decode(args.samples, args.repeat),
+        'device':
+            {
+                'rhd': bench_device(False, args.realtime, args.repeat),
+                'rhs': bench_device(True, args.realtime, args.repeat),
+            },
+        'uploads': bench_uploads(args.repeat),
+        'profile':
+            {
+                'rhd': profile_device(False, args.realtime),
+                'rhs': profile_device(True, args.realtime),
+            },
+    }
+    report['max_rss'] = max_rss()
+    args.output.write_text(json.dumps(report, indent=4))
+    for r in report['decode']:
+        print(
+            f"{r['op']:>16} {'RHS' if r['rhs'] else 'RHD'} x{r['datastreams']:<2}"
+            f"{' 32DIO' if r['mode32DIO'] else '      '} {r['MBps']:10.1f} MB/s"
+            f" {r['samples_per_s']:14.0f} samples/s"
+        )
+    for device, results in report['device'].items():
+        for name, r in results.items():
+            print(
+                f"{device} {name:>24} p50 {r['latency']['p50'] * 1e3:9.2f} ms"
+                f" peak {r['peak_memory'] / 2**20:8.2f} MiB"
+            )
+    for name, r in report['uploads'].items():
+        print(
+            f"rhd {name:>28} p50 {r['latency']['p50'] * 1e3:9.2f} ms"
+            f" {r['transactions']:6} USB transactions"
+        )
+    print(f'{args.output} is generated.')
+    return report
+
+
+if __name__ == '__main__':
+    main()
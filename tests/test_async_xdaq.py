@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from pyxdaq.async_xdaq import AsyncXDAQ
+from pyxdaq.simulator import SimulatedBoard
+from pyxdaq.xdaq import get_XDAQ
+
+
+def test_async_xdaq():
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False))
+
+    async def main():
+        async with AsyncXDAQ(xdaq) as axdaq:
+            block = await axdaq.run_and_read(128 * 4)
+            assert np.array_equal(block.data['ts'], np.arange(512))
+            assert await axdaq.run_and_read(128, discard=True) is None
+
+            # concurrent calls run one at a time on the same worker thread
+            active = []
+            threads = set()
+
+            def work():
+                active.append(1)
+                threads.add(threading.get_ident())
+                time.sleep(0.002)
+                overlap = len(active) > 1
+                active.pop()
+                return overlap
+
+            assert not any(await asyncio.gather(*[axdaq.call(work) for _ in range(8)]))
+            assert len(threads) == 1 and threading.get_ident() not in threads
+
+            ts = []
+            async with axdaq.stream(chunk_samples=128, buffers=4) as stream:
+                # device calls made while streaming hold the stream lock
+                assert await axdaq.call(stream.stream.lock.locked)
+                async for block in stream:
+                    ts.extend(block.data['ts'])
+                    if len(ts) >= 128 * 8:
+                        break
+            assert ts == list(range(len(ts)))
+            assert not await axdaq.is_running()
+            assert await axdaq.numWordsInFifo() == 0
+
+    asyncio.run(main())
+
+
+def test_async_xdaq_close():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False))
+
+    async def main():
+        ticks = []
+        async with AsyncXDAQ(xdaq) as axdaq:
+            pending = asyncio.ensure_future(axdaq.call(time.sleep, 0.2))
+            await asyncio.sleep(0.01)
+
+            async def tick():
+                while not pending.done():
+                    ticks.append(1)
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.ensure_future(tick())
+        # the loop kept running while the executor waited for the call in flight
+        await ticker
+        assert len(ticks) > 5
+
+    asyncio.run(main())
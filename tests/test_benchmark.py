@@ -0,0 +1,14 @@
+import importlib.util
+import json
+from pathlib import Path
+
+
+def test_benchmark_smoke(tmp_path):
+    path = Path(__file__).parent.parent / 'scripts' / 'benchmark.py'
+    spec = importlib.util.spec_from_file_location('benchmark', path)
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+    benchmark.main(['--quick', '--output', str(tmp_path / 'benchmark.json')])
+    report = json.loads((tmp_path / 'benchmark.json').read_text())
+    assert {r['op'] for r in report['decode']} == {'from_buffer', 'to_samples', 'to_samples_view'}
+    assert {'set_stim', 'set_stim_cached'} <= set(report['device']['rhs'])
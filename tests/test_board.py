@@ -0,0 +1,140 @@
+import contextlib
+
+from pyxdaq import impedance
+from pyxdaq.board import Board
+from pyxdaq.constants import RHD
+from pyxdaq.simulator import SimulatedBoard
+from pyxdaq.xdaq import XDAQ, get_XDAQ
+
+
+def _board():
+    board = SimulatedBoard(rhs=False, realtime=False, profile=True)
+    board.config_fpga('rhd.bit')
+    board.profiler.reset()
+    return board
+
+
+def _calls(board, caller='<none>'):
+    report = board.profiler.report().get(caller, {'calls': {}})
+    return {name: c['calls'] for name, c in report['calls'].items()}
+
+
+def test_batch_coalesces_wire_ins():
+    board = _board()
+    with board.batch():
+        board.SetWireInValue(RHD.WireInDacSource1, 1)
+        board.SetWireInValue(RHD.WireInDacSource2, 2)
+        board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12, 0xff)
+        board.SetWireInValue(RHD.WireInMaxTimeStep, 0x3400, 0xff00)
+        with board.batch():
+            board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12, 0xff)
+        assert board.sim.wires[RHD.WireInDacSource1.value] == 0
+    assert _calls(board)['UpdateWireIns'] == 1
+    assert board.sim.wires[RHD.WireInDacSource2.value] == 2
+    assert board.sim.wires[RHD.WireInMaxTimeStep.value] == 0x3412
+
+
+def test_batch_preserves_ordering():
+    board = _board()
+    with board.batch():
+        # both edges of the pulse must reach the device
+        board.SetWireInValue(RHD.WireInResetRun, 1 << 17, 1 << 17)
+        board.SetWireInValue(RHD.WireInResetRun, 0, 1 << 17)
+        assert _calls(board)['UpdateWireIns'] == 1
+        # the trigger consumes the multi-use wire
+        board.SendTrig(RHD.TrigInConfig, 9, RHD.WireInMultiUse, 256)
+        assert board.sim.wires[RHD.WireInMultiUse.value] == 256
+        board.ActivateTriggerIn(RHD.TrigInSpiStart, 1)
+    assert _calls(board)['UpdateWireIns'] == 2
+
+
+def test_shadow_skips_redundant_writes():
+    board = _board()
+    board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12, 0xff)
+    board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12, 0xff)
+    board.SetWireInValue(RHD.WireInMaxTimeStep, 0x2, 0xf)
+    assert _calls(board) == {'SetWireInValue': 1, 'UpdateWireIns': 1}
+    # only part of the endpoint is known
+    board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12)
+    # a skipped write still sends the previous deferred one
+    board.SetWireInValue(RHD.WireInDacManual, 7, update=False)
+    board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12)
+    assert _calls(board) == {'SetWireInValue': 3, 'UpdateWireIns': 3}
+    assert board.sim.wires[RHD.WireInDacManual.value] == 7
+    board.invalidate()
+    board.SetWireInValue(RHD.WireInMaxTimeStep, 0x12)
+    assert _calls(board) == {'SetWireInValue': 4, 'UpdateWireIns': 4}
+
+
+def test_repeated_configuration_is_skipped():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False, profile=True))
+    xdaq.measure_impedance(impedance.Frequency(1000.0), channels=[0], progress=False)
+    xdaq.dev.profiler.reset()
+    for i in range(8):
+        xdaq.enableDac(i, False)
+    xdaq.setStimCmdMode(False)
+    assert _calls(xdaq.dev, 'enableDac') == {}
+    assert _calls(xdaq.dev, 'setStimCmdMode') == {}
+
+
+def test_batched_initialize():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False, profile=True))
+    profiler = xdaq.dev.profiler
+    profiler.reset()
+    xdaq.initialize()
+    batched = _calls(xdaq.dev, 'initialize')['UpdateWireIns']
+    samples = xdaq.runAndReadSamples(128)
+    assert samples.ts.tolist() == list(range(128))
+
+    # reset_board forgets the known wire-ins, every initialize sends all of them
+    xdaq.batch = contextlib.nullcontext
+    profiler.reset()
+    xdaq.initialize()
+    assert batched < _calls(xdaq.dev, 'initialize')['UpdateWireIns'] * 2 // 3
+
+
+def test_wire_out_snapshot():
+    board = _board()
+    with board.wireOutSnapshot():
+        board.GetWireOutValue(RHD.WireOutNumWords)
+        board.GetWireOutValue(RHD.WireOutSpiRunning)
+        assert _calls(board)['UpdateWireOuts'] == 1
+        # the device state may change after a trigger
+        board.ActivateTriggerIn(RHD.TrigInSpiStart, 1)
+        board.GetWireOutValue(RHD.WireOutSpiRunning)
+        board.GetWireOutValue(RHD.WireOutNumWords)
+        assert _calls(board)['UpdateWireOuts'] == 2
+    with board.wireOutSnapshot(max_age=60):
+        board.GetWireOutValue(RHD.WireOutNumWords)
+    assert _calls(board)['UpdateWireOuts'] == 2
+    board.GetWireOutValue(RHD.WireOutNumWords)
+    assert _calls(board)['UpdateWireOuts'] == 3
+
+
+def test_config_fpga_wire_out_reads():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False, profile=True))
+    calls = _calls(xdaq.dev, 'config_fpga')
+    assert calls['GetWireOutValue'] == 13
+    assert calls['UpdateWireOuts'] == 3
+
+
+def test_board_defaults():
+
+    class PlainBoard(Board):
+
+        def __init__(self):
+            self.calls = []
+
+        def SetWireInValue(self, addr, value, mask=0xffffffff, update=True):
+            self.calls.append(('SetWireInValue', addr, value))
+
+        def SendTrig(self, trig, bit, epAddr, value, mask=0xffffffff):
+            self.calls.append(('SendTrig', trig, bit))
+
+    board = PlainBoard()
+    xdaq = XDAQ(dev=board)
+    xdaq.ep = RHD
+    with xdaq.batch(), board.wireOutSnapshot():
+        xdaq.reset_board()
+    board.reset_host_state()
+    assert [c[0] for c in board.calls] == ['SetWireInValue'] * 2 + ['SendTrig'] * 2
@@ -0,0 +1,20 @@
+from pyxdaq.buffers import BufferPool
+
+
+def test_buffer_pool_reuse():
+    pool = BufferPool(per_class=1, classes=2)
+    with pool.borrow(1000) as a:
+        assert len(a) == 1024
+    with pool.borrow(1024) as b:
+        assert b is a
+    pool.acquire(5000)
+    pool.release(bytearray(2048))
+    pool.release(bytearray(4096))  # evicts the 1024 class
+    assert pool.acquire(1024) is not a
+    assert (pool.hits, pool.misses) == (1, 3)
+
+
+def test_chunk_size():
+    assert [BufferPool.chunk_size(n) for n in [0, 1023, 1024, 3072, 4096, 5000]] == [
+        1024, 1024, 1024, 2048, 4096, 4096
+    ]
@@ -0,0 +1,123 @@
+import struct
+
+import numpy as np
+import pytest
+
+from pyxdaq.datablock import (
+    _RHD_HEADER_MAGIC, _RHS_HEADER_MAGIC, BlockDecoder, DataBlock, Sample, check_block,
+    sample_dtype
+)
+
+
+def _frames(rhs, datastreams, mode32DIO, n, seed=0):
+    dtype = sample_dtype(rhs, datastreams, mode32DIO)
+    rng = np.random.default_rng(seed)
+    buffer = bytearray(rng.integers(0, 256, n * dtype.itemsize, dtype=np.uint8).tobytes())
+    magic = struct.pack('<Q', _RHS_HEADER_MAGIC if rhs else _RHD_HEADER_MAGIC)
+    for i in range(n):
+        buffer[i * dtype.itemsize:i * dtype.itemsize + 8] = magic
+        buffer[i * dtype.itemsize + 8:i * dtype.itemsize + 12] = struct.pack('<I', i)
+    return dtype.itemsize, buffer
+
+
+@pytest.mark.parametrize(
+    'rhs,datastreams,mode32DIO', [
+        (False, 1, False),
+        (False, 3, True),
+        (False, 16, False),
+        (True, 1, False),
+        (True, 8, False),
+    ]
+)
+def test_block_matches_per_sample_decoder(rhs, datastreams, mode32DIO):
+    sample_size, buffer = _frames(rhs, datastreams, mode32DIO, 256)
+    sp = DataBlock.from_buffer(rhs, sample_size, buffer, datastreams, mode32DIO).to_samples()
+    ref = [
+        Sample.from_buffer(rhs, buffer[i:i + sample_size], datastreams, mode32DIO)
+        for i in range(0, len(buffer), sample_size)
+    ]
+    assert sp.n == 256
+    assert np.array_equal(sp.ts, np.arange(256))
+    for field in ['aux', 'amp', 'adc', 'ttlin', 'ttlout'] + (['dac', 'stim'] if rhs else []):
+        assert np.array_equal(getattr(sp, field), np.stack([getattr(r, field) for r in ref]))
+
+
+def test_invalid_magic():
+    sample_size, buffer = _frames(False, 2, False, 4)
+    buffer[sample_size * 2] ^= 0xff
+    with pytest.raises(ValueError, match='Invalid magic'):
+        DataBlock.from_buffer(False, sample_size, buffer, 2, False)
+
+
+def test_zero_copy_samples():
+    sample_size, buffer = _frames(True, 2, False, 128)
+    block = DataBlock.from_buffer(True, sample_size, buffer, 2, False)
+    view = block.to_samples(copy=False)
+    assert np.shares_memory(view.amp, np.frombuffer(buffer, np.uint8))
+    copied = view.copy()
+    assert not np.shares_memory(copied.amp, np.frombuffer(buffer, np.uint8))
+    assert np.array_equal(copied.amp, block.to_samples().amp)
+
+
+def test_check_block():
+    sample_size, buffer = _frames(False, 1, False, 16)
+    data = DataBlock.from_buffer(False, sample_size, buffer, 1, False).data.copy()
+    assert DataBlock(data, False).check().ok
+    data['ts'][5:] += 3  # three samples dropped before sample 5
+    data['ts'][9] = data['ts'][8]  # sample 9 repeated
+    data['magic'][12] = 0
+    res = check_block(data, False, last_ts=2**32 - 1)
+    assert not res.ok
+    assert res.misaligned.tolist() == [12]
+    assert res.gaps.tolist() == [5, 10]
+    assert res.missing.tolist() == [3, 1]
+    assert res.duplicates.tolist() == [9]
+    assert res.last_ts == data['ts'][15]
+
+
+def test_block_decoder_resync():
+    sample_size, buffer = _frames(True, 2, False, 64)
+    # a glitch drops the second half of sample 10 and the stream starts mid-frame
+    stream = buffer[100:sample_size * 10 + 30] + buffer[sample_size * 11:]
+    decoder = BlockDecoder(True, 2, False)
+    ts = []
+    for start in range(0, len(stream), 1000):
+        ts.extend(decoder.decode(stream[start:start + 1000]).data['ts'])
+    assert ts == list(range(1, 10)) + list(range(11, 64))
+    assert decoder.resyncs == 2
+    assert decoder.discarded_bytes == (sample_size - 100) + 30
+    assert decoder.pending_bytes == 0
+
+
+def test_block_decoder_drops_spliced_frames():
+    sample_size, buffer = _frames(False, 1, False, 16)
+    assert sample_size == 104
+    # 14 bytes cut at offset 100 of sample 5 remove its tail and the header of sample 6
+    cut = sample_size * 5 + 100
+    stream = buffer[:cut] + buffer[cut + 14:]
+    decoder = BlockDecoder(False, 1, False)
+    block = decoder.decode(stream)
+    assert block.data['ts'].tolist() == list(range(5)) + list(range(7, 16))
+    assert decoder.corrupt_frames == 1
+    assert decoder.pending_bytes == 0
+
+    frames = {bytes(buffer[i:i + sample_size]) for i in range(0, len(buffer), sample_size)}
+    rng = np.random.default_rng(1)
+    for _ in range(300):
+        cut = int(rng.integers(0, len(buffer) - 32))
+        length = int(rng.integers(1, 32))
+        stream = buffer[:cut] + buffer[cut + length:]
+        block = BlockDecoder(False, 1, False).decode(stream)
+        assert all(bytes(r) in frames for r in block.data.view(np.uint8).reshape(-1, sample_size))
+
+
+@pytest.mark.parametrize('rhs', [False, True])
+def test_to_samples_modes(rhs):
+    sample_size, buffer = _frames(rhs, 2, False, 128)
+    block = DataBlock.from_buffer(rhs, sample_size, buffer, 2, False)
+    copied, view = block.to_samples(), block.to_samples(copy=False)
+    assert copied.ts.dtype == view.ts.dtype == np.int64
+    for field in ['ts', 'aux', 'amp', 'adc', 'ttlin', 'ttlout'] + (['dac', 'stim'] if rhs else []):
+        assert np.array_equal(getattr(copied, field), getattr(view, field))
+        assert getattr(copied, field).flags.c_contiguous
+        assert not np.shares_memory(getattr(copied, field), np.frombuffer(buffer, np.uint8))
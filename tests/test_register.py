@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from pyxdaq import resources
+from pyxdaq.constants import SampleRate
+from pyxdaq.intan_headstage import command_lists
+from pyxdaq.rhd_driver import RHDDriver
+from pyxdaq.rhs_driver import RHSDriver
+
+
+def test_drivers_share_parsed_configs():
+    for R, res in [(RHDDriver, resources.rhd), (RHSDriver, resources.rhs)]:
+        a = R(SampleRate.SampleRate30000Hz, res.reg_path, res.isa_path)
+        default = a.controller.get('dspCutoffFreq')
+        a.controller.set('dspCutoffFreq', default ^ 1)
+        b = R(SampleRate.SampleRate1000Hz, str(res.reg_path), str(res.isa_path))
+        assert a.isa is b.isa
+        assert a.controller.named_registers is b.controller.named_registers
+        # register values start from the defaults and are not shared between drivers
+        assert b.controller.get('dspCutoffFreq') == default
+        assert a.controller.get('muxBias') != b.controller.get('muxBias')
+
+
+def test_encode_many_matches_machinecode():
+    d = RHSDriver(SampleRate.SampleRate30000Hz, resources.rhs.reg_path, resources.rhs.isa_path)
+    addr = np.arange(0, 256, 3)
+    ref = [d.encode('read', addr=a) for a in addr]
+    assert np.array_equal(d.encode_many('read', addr=addr), ref)
+    assert d.encode_many('read', addr=addr).dtype == d.isa.dtype
+    ref = [d.encode('write', addr=a) for a in range(64, 80)]
+    assert np.array_equal(d.encode_many('write', addr=range(64, 80)), ref)
+    values = np.arange(256)
+    ref = [d.encode('writeval', addr=3, value=int(v)) for v in values]
+    assert np.array_equal(d.encode_many('writeval', addr=3, value=values), ref)
+    with pytest.raises(ValueError, match='Variable operand value not specified'):
+        d.encode_many('writeval', addr=3)
+    with pytest.raises(ValueError, match='Overflow'):
+        d.encode_many('writeval', addr=3, value=[0, 1 << 40])
+
+
+def test_command_list_cache():
+    command_lists.clear()
+    hits = command_lists.hits
+    drivers = [
+        RHDDriver(SampleRate.SampleRate30000Hz, resources.rhd.reg_path, resources.rhd.isa_path)
+        for _ in range(2)
+    ]
+    cmds = []
+    for d in drivers:
+        assert d.controller.get('tempEnable') == 0
+        cmds.append(d.createCommandListUpdateDigOut())
+        # the register writes of the generator are replayed on a hit
+        assert d.controller.get('tempEnable') == 1
+    assert command_lists.hits == hits + 1
+    assert cmds[0] is cmds[1] and not cmds[0].flags.writeable
+    # a different register state is a different command list
+    drivers[1].controller.set('zcheckSelect', 3)
+    assert not np.array_equal(
+        drivers[0].createCommandListRegisterConfig(False),
+        drivers[1].createCommandListRegisterConfig(False)
+    )
+    assert command_lists.hits == hits + 1
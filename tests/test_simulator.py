@@ -0,0 +1,326 @@
+import time
+
+import numpy as np
+import pytest
+
+from pyxdaq import impedance
+from pyxdaq.constants import (
+    HeadstageChipID, SampleRate, StartPolarity, StimRegister, StimShape, StimStepSize,
+    TriggerEvent, TriggerPolarity
+)
+from pyxdaq.datablock import DataBlock
+from pyxdaq.simulator import SimulatedBoard
+from pyxdaq.stim import StimProgram, enable_stim_many, stim_settings
+from pyxdaq.xdaq import get_XDAQ
+
+
+@pytest.mark.parametrize('rhs', [False, True])
+def test_simulated_board(rhs):
+    xdaq = get_XDAQ(rhs=rhs, dev=SimulatedBoard(realtime=False))
+    chip = HeadstageChipID.RHS2116 if rhs else HeadstageChipID.RHD2164
+    assert [s.chip for s in xdaq.ports.streams if s.available] == [chip] * (1 if rhs else 2)
+    block = xdaq.runAndReadDataBlock(128 * 4)
+    assert len(block) == 512 and block.check().ok
+    assert np.array_equal(block.data['ts'], np.arange(512))
+
+
+@pytest.mark.parametrize('rhs', [False, True])
+def test_simulated_impedance(rhs):
+    xdaq = get_XDAQ(rhs=rhs, dev=SimulatedBoard(realtime=False, impedance=2e5))
+    magnitude, phase = xdaq.measure_impedance(
+        impedance.Frequency(1000.0), channels=[0, 3], progress=False
+    )
+    assert np.allclose(magnitude[0], 2e5, rtol=0.1)
+
+
+@pytest.mark.parametrize('rhs', [False, True])
+def test_impedance_sweep(rhs):
+    xdaq = get_XDAQ(rhs=rhs, dev=SimulatedBoard(realtime=False, impedance=2e5))
+    frequencies = [200.0, 1000.0, 200.0]
+    magnitude, phase = xdaq.measure_impedance_sweep(frequencies, channels=[0, 3], progress=False)
+    assert magnitude.shape == phase.shape == (3, 1 if rhs else 2, 2)
+    assert np.allclose(magnitude[:, 0], 2e5, rtol=0.1)
+    assert np.array_equal(magnitude[0], magnitude[2])
+    ref = xdaq.measure_impedance(impedance.Frequency(1000.0), channels=[0, 3], progress=False)
+    assert np.allclose(magnitude[1], ref[0]) and np.allclose(phase[1], ref[1])
+
+
+@pytest.mark.parametrize('rhs', [False, True])
+def test_aux_command_uploads(rhs):
+    xdaq = get_XDAQ(rhs=rhs, dev=SimulatedBoard(realtime=False, profile=True))
+    ram = xdaq.dev.sim.ram[1, 0 if rhs else 2]
+    cmd = np.arange(100, 300, dtype=np.uint32 if rhs else np.uint16)
+    xdaq.uploadCommandList(cmd, 1, 2)
+    assert np.array_equal(ram[:len(cmd)], cmd)
+
+    profiler = xdaq.dev.profiler
+    profiler.reset()
+    xdaq.uploadCommandList(cmd, 1, 2)
+    assert profiler.report() == {}
+
+    cmd[[3, 70, 150]] = 7
+    xdaq.uploadCommandList(cmd, 1, 2)
+    assert np.array_equal(ram[:len(cmd)], cmd)
+    calls = profiler.report()['uploadCommandList']['calls']
+    if rhs:
+        assert calls['WriteToBlockPipeIn']['calls'] == 1
+    else:
+        assert calls['ActivateTriggerIn']['calls'] == 3
+
+    xdaq.reset_board()
+    profiler.reset()
+    xdaq.uploadCommandList(cmd, 1, 2)
+    assert 'uploadCommandList' in profiler.report()
+
+
+def test_program_stim_regs():
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False))
+    regs = xdaq.dev.sim.stim_regs
+    assert len(regs) == 8 * 16 * 14 + 8 * 11 + 16 * 6
+    assert regs[3, 5, StimRegister.EventEnd.value] == 65534
+    table = [(s, c, StimRegister.EventStartStim, 10 * s + c) for s in range(8) for c in range(16)]
+    table.append((0, 0, StimRegister.EventEnd, 65534))
+    assert xdaq.programStimRegs(table) == 128
+    assert regs[3, 5, StimRegister.EventStartStim.value] == 35
+    assert xdaq.programStimRegs(table) == 0
+    # a later row for the same register wins
+    assert xdaq.programStimRegs([(1, 1, 4, 1), (1, 1, 4, 2)]) == 1
+    assert regs[1, 1, 4] == 2
+    xdaq.reset_board()
+    assert xdaq.programStimRegs(table) == 129
+
+
+def _stim_settings():
+    return dict(
+        stream=0,
+        step_size=StimStepSize.StimStepSize1uA,
+        amp_pos_mA=0.01,
+        trigger=TriggerEvent.Edge,
+        trigger_source=24,
+        trigger_pol=TriggerPolarity.High,
+        pulses=1,
+        polarity=StartPolarity.cathodic,
+        shape=StimShape.Biphasic,
+        pre_ampsettle_ms=0,
+        delay_ms=0,
+        phase1_ms=0.1,
+        phase2_ms=0.1,
+        phase3_ms=0,
+        post_pulse_ms=1,
+        post_ampsettle_ms=0,
+        post_charge_recovery_ms=0,
+    )
+
+
+def test_enable_stim_many():
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False))
+    runs = []
+    run = xdaq.runAndReadBuffer
+    xdaq.runAndReadBuffer = lambda *args, **kwargs: runs.append(1) or run(*args, **kwargs)
+    settings = _stim_settings()
+    channels = [0, 3, 7, 15]
+    disable = enable_stim_many(
+        xdaq, [dict(settings, channel=c, amp_neg_mA=0.001 * (c + 1)) for c in channels]
+    )
+    assert len(runs) == 3
+    regs = xdaq.dev.sim._regs[0]
+    trigger = StimRegister.Trigger.value
+    for c in range(16):
+        assert bool(xdaq.dev.sim.stim_regs[0, c, trigger] & 0x80) == (c in channels)
+        assert regs[64 + c] & 0xff == (c + 1 if c in channels else 0)
+        assert regs[96 + c] & 0xff == (10 if c in channels else 0)
+
+    disable()
+    assert len(runs) == 6
+    for c in channels:
+        assert not xdaq.dev.sim.stim_regs[0, c, trigger] & 0x80
+        assert regs[64 + c] & 0xff == 0
+
+    with pytest.raises(ValueError, match='step sizes'):
+        xdaq.set_stim_many(
+            [
+                stim_settings(xdaq, **settings, channel=0, amp_neg_mA=0),
+                stim_settings(
+                    xdaq,
+                    **dict(settings, step_size=StimStepSize.StimStepSize10uA),
+                    channel=1,
+                    amp_neg_mA=0
+                ),
+            ],
+            enable=True
+        )
+
+
+def test_stim_program():
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False, profile=True))
+    sim = xdaq.dev.sim
+    program = StimProgram(
+        xdaq, [dict(_stim_settings(), channel=c, amp_neg_mA=0.01) for c in [2, 5]]
+    )
+    trigger = StimRegister.Trigger.value
+    profiler = xdaq.dev.profiler
+    profiler.reset()
+    program.arm()
+    assert profiler.report()['loadStim']['calls']['ActivateTriggerIn']['calls'] > 3
+    assert sim.stim_regs[0, 5, trigger] & 0x80 and sim._regs[0][64 + 5] & 0xff == 10
+
+    profiler.reset()
+    program.disarm()
+    assert not sim.stim_regs[0, 2, trigger] & 0x80 and not sim.stim_regs[0, 5, trigger] & 0x80
+    assert sim._regs[0][64 + 5] & 0xff == 10
+    with program:
+        assert sim.stim_regs[0, 2, trigger] & 0x80
+    assert not sim.stim_regs[0, 2, trigger] & 0x80
+    # two triggers per toggle and no sequencer run
+    report = profiler.report()
+    assert 'runAndReadBuffer' not in report
+    assert sum(c['calls']['ActivateTriggerIn']['calls'] for c in report.values()) == 6
+
+    # the register config on the chips is replaced, arming loads the program again
+    xdaq.set_stim_many([stim_settings(xdaq, **_stim_settings(), channel=5, amp_neg_mA=0)], True)
+    assert sim._regs[0][64 + 5] & 0xff == 0
+    program.arm()
+    assert sim._regs[0][64 + 5] & 0xff == 10
+
+    # uploads to other slots and aux command selection changes also force a reload
+    runs = []
+    run = xdaq.runAndReadBuffer
+    xdaq.runAndReadBuffer = lambda *args, **kwargs: runs.append(1) or run(*args, **kwargs)
+    for change in [
+        lambda: xdaq.uploadCommandList(np.arange(16, dtype=np.uint32), 2, 0),
+        lambda: xdaq.selectAuxCommandLength(1, 0, 15),
+        lambda: xdaq.enableAuxCommandsOnOneStream(0),
+    ]:
+        program.arm()
+        change()
+        runs.clear()
+        program.arm()
+        assert len(runs) == 3
+
+
+def test_background_run():
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False))
+    ts = []
+    with xdaq.runInBackground(128 * 40, chunk_samples=128 * 8,
+                              callback=lambda b: ts.extend(b.data['ts']), decimate=16) as run:
+        pass
+    assert run.progress == 1 and not run.cancelled
+    assert ts == list(range(0, 128 * 40, 16))
+
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=True))
+    run = xdaq.runInBackground(int(xdaq.sampleRate.rate * 60), chunk_samples=128).start()
+    assert not run.wait(0.2)
+    run.cancel()
+    assert run.cancelled and 0 < run.progress < 0.1
+    assert not xdaq.is_running() and xdaq.numWordsInFifo() == 0
+    assert run.wait()
+
+
+def test_background_run_partial_block():
+    xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=False))
+    # 1000 samples do not end on a 1024 bytes pipe block
+    assert xdaq.getSampleSizeBytes() * 1000 % 1024 != 0
+    ts = []
+    with xdaq.runInBackground(1000, callback=lambda b: ts.extend(b.data['ts'])) as run:
+        pass
+    assert run.progress == 1 and not run.cancelled
+    assert ts == list(range(1000))
+    assert xdaq.numWordsInFifo() == 0
+    assert xdaq.runAndReadDataBlock(128).check().ok
+
+
+def test_data_stream():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False))
+    ts = []
+    with xdaq.stream(chunk_samples=128, buffers=4) as stream:
+        for block in stream:
+            assert block.check(ts[-1] if ts else None).ok
+            ts.extend(block.data['ts'])
+            if len(ts) >= 128 * 20:
+                break
+    assert ts == list(range(len(ts)))
+    assert stream.dropped == 0 and stream.samples == len(ts)
+    assert not stream.running
+    assert not xdaq.is_running() and xdaq.numWordsInFifo() == 0
+
+
+def test_data_stream_low_sample_rate():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=True))
+    xdaq.setSampleRate(SampleRate.SampleRate1000Hz)
+    # the default wait covers the time to fill one chunk
+    assert xdaq.stream().timeout > 128 * 64 / 1000
+    with pytest.raises(TimeoutError):
+        with xdaq.stream(chunk_samples=128, timeout=0.01) as stream:
+            next(stream)
+    with xdaq.stream(chunk_samples=128 * 4) as stream:
+        assert len(next(stream)) == 128 * 4
+
+
+def test_data_stream_reader_error():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False))
+
+    def fail(buffer):
+        raise RuntimeError('pipe out failed')
+
+    xdaq.readDataToBuffer = fail
+    stream = xdaq.stream(chunk_samples=128).start()
+    with pytest.raises(RuntimeError, match='pipe out failed'):
+        for _ in stream:
+            pass
+    assert not stream.running
+    del xdaq.readDataToBuffer
+    stream.stop()
+    assert not xdaq.is_running() and xdaq.numWordsInFifo() == 0
+
+
+@pytest.mark.parametrize('realtime', [False, True])
+def test_wait_for_run_end(realtime):
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=realtime))
+    samples = 3000
+    duration = samples / xdaq.sampleRate.rate
+    xdaq.resetSequencers()
+    xdaq.setMaxTimeStep(samples)
+    xdaq.setContinuousRunMode(False)
+    xdaq.run()
+    start = time.perf_counter()
+    # without the sample count the wait has to poll until the run is over
+    xdaq.waitForRunEnd(None if realtime else samples)
+    elapsed = time.perf_counter() - start
+    stats = xdaq.run_wait_stats
+    assert stats.waits == 1 and stats.polls == stats.last_polls
+    assert not xdaq.is_running()
+    assert xdaq.numWordsInFifo() * 2 == samples * xdaq.getSampleSizeBytes()
+    if realtime:
+        assert stats.last_polls > 1
+        assert duration <= elapsed < duration + 0.05
+    else:
+        # the run is over when the expected duration has been slept, one poll observes it
+        assert stats.last_polls == 1
+        assert duration - 0.001 <= elapsed < duration + 0.05
+        assert stats.last_latency < 0.05
+
+
+@pytest.mark.parametrize('realtime', [False, True])
+def test_read_while_running(realtime):
+    samples = 128 * 37
+    buffers = []
+    for read_while_running in [True, False]:
+        xdaq = get_XDAQ(rhs=True, dev=SimulatedBoard(realtime=realtime))
+        xdaq.readWhileRunning = read_while_running
+        # several chunks, the last reads are smaller powers of two
+        xdaq.readChunkBytes = 4096
+        assert xdaq.getSampleSizeBytes() * samples > 4 * xdaq.readChunkBytes
+        reads = []
+        read = xdaq.readDataToBuffer
+        xdaq.readDataToBuffer = lambda buffer: reads.append(len(buffer)) or read(buffer)
+        n, buffer = xdaq.runAndReadBuffer(samples)
+        if read_while_running:
+            # a FIFO holding the whole run is still read in chunks
+            assert len(reads) > 4 and max(reads) <= xdaq.readChunkBytes
+        assert n == len(buffer)
+        buffers.append(buffer)
+    assert buffers[0] == buffers[1]
+    block = DataBlock.from_buffer(
+        True, xdaq.getSampleSizeBytes(), buffers[0], xdaq.numDataStream, False
+    )
+    assert np.array_equal(block.data['ts'], np.arange(samples))
@@ -0,0 +1,47 @@
+import gc
+import json
+import weakref
+
+import pytest
+
+from pyxdaq.simulator import SimulatedBoard
+from pyxdaq.xdaq import get_XDAQ
+
+
+@pytest.mark.parametrize('rhs', [False, True])
+def test_profiling_wrapper(rhs, tmp_path):
+    xdaq = get_XDAQ(rhs=rhs, dev=SimulatedBoard(realtime=False, profile=True))
+    profiler = xdaq.dev.profiler
+    assert 'initialize' in profiler.report()
+
+    profiler.reset()
+    for delay in [13, 14, 15]:
+        xdaq.setCableDelay(0, delay)
+    xdaq.runAndReadBuffer(128)
+    profiler.GetWireOutValue(0x20)
+    report = profiler.report()
+    assert report['setCableDelay']['invocations'] == 3
+    assert report['setCableDelay']['calls']['UpdateWireIns']['calls'] == 3
+    read = report['runAndReadBuffer']['calls']['ReadFromBlockPipeOut']
+    assert read['bytes'] == 128 * xdaq.getSampleSizeBytes()
+    assert report['<none>']['calls']['GetWireOutValue']['calls'] == 1
+
+    profiler.save(tmp_path / 'profile.json')
+    assert json.loads((tmp_path / 'profile.json').read_text()).keys() == report.keys()
+    assert 'setCableDelay x3' in profiler.format()
+
+
+def test_profiling_wrapper_releases_frames():
+    xdaq = get_XDAQ(rhs=False, dev=SimulatedBoard(realtime=False, profile=True))
+
+    class Buffer(bytearray):
+        pass
+
+    buffer = Buffer(128 * xdaq.getSampleSizeBytes())
+    ref = weakref.ref(buffer)
+    xdaq.runAndReadBuffer(128, out=buffer)
+    del buffer
+    gc.collect()
+    assert ref() is None
+    xdaq.runAndReadBuffer(128)
+    assert xdaq.dev.profiler.report()['runAndReadBuffer']['invocations'] == 2